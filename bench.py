@@ -0,0 +1,283 @@
+"""Benchmarks for the hot paths of interpreter.py and spi.py.
+
+Every benchmark builds its input outside the timed region, then runs one
+workload at each of its sizes. Results are written as JSON: wall time (the
+best of --repeat runs), peak traced memory of one further run, and node or
+term counts of the result, so that runs from two revisions can be compared
+with --compare.
+
+    $ python bench.py -o before.json
+    $ python bench.py --compare before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import interpreter
+import spi
+
+# name -> (function, sizes); the function takes a size and returns a
+# zero-argument workload that returns a dict of counts
+BENCHMARKS = {}
+
+def benchmark(*sizes):
+    def register(function):
+        BENCHMARKS[function.__name__] = (function, sizes)
+        return function
+    return register
+
+def fresh_interpreter():
+    """Return an spi Interpreter with empty scopes of its own."""
+    return spi.Interpreter(isolated = True)
+
+def variable(char):
+    return interpreter.Poly({interpreter.monomial((char,),(1,)):1})
+
+def constant(n):
+    return interpreter.Poly({interpreter.monomial():n})
+
+def nodes(tree):
+    return len(spi.encode(tree))
+
+@benchmark(8, 16, 24)
+def poly_power(n):
+    """Expand (x+y+z)^n by repeated Poly multiplication."""
+    base = variable('x') + variable('y') + variable('z')
+    def run():
+        result = constant(1)
+        for i in range(n):
+            result = result * base
+        return {'terms': len(result.terms)}
+    return run
+
+@benchmark(1000, 10000, 100000)
+def poly_add(n):
+    """Add and subtract n-term polynomials that share half their terms."""
+    a = interpreter.Poly({interpreter.monomial(('x','y'),(i,i % 5)):i + 1 for i in range(n)})
+    b = interpreter.Poly({interpreter.monomial(('x','y'),(i,i % 5)):2 for i in range(n // 2, n + n // 2)})
+    def run():
+        result = a + b - a
+        return {'terms': len(result.terms)}
+    return run
+
+@benchmark(10, 20, 40)
+def poly_expand_power(n):
+    """Expand (a+b+c+d)^n with the ^ operator."""
+    base = variable('a') + variable('b') + variable('c') + variable('d')
+    def run():
+        result = base ** n
+        return {'terms': len(result.terms)}
+    return run
+
+@benchmark(1000, 10000)
+def poly_subs(n):
+    """Evaluate (a+b+c+d)^8 at n points through its Horner form."""
+    poly = (variable('a') + variable('b') + variable('c') + variable('d')) ** 8
+    def run():
+        total = 0.0
+        for i in range(n):
+            total += poly.subs({'a': i / n, 'b': 0.5, 'c': -0.25, 'd': 1.5})
+        return {'terms': len(poly.terms)}
+    return run
+
+@benchmark(8, 16, 32)
+def frac_annihilate(n):
+    """Cancel the common factor (x+y)^n out of a quotient."""
+    common = constant(1)
+    for i in range(n):
+        common = common * (variable('x') + variable('y'))
+    num = common * (variable('x') - variable('y'))
+    den = common * (variable('x') + constant(2))
+    def run():
+        result = interpreter.Frac(num.copy(), den.copy())
+        return {'terms': len(result.num.terms) + len(result.den.terms)}
+    return run
+
+@benchmark(5, 10, 20)
+def calc_expression(n):
+    """Evaluate an n-factor rational expression with interpreter.py."""
+    text = ' + '.join(f'(x+{i})/(y+{i})' for i in range(n))
+    def run():
+        result = interpreter.Interpreter(interpreter.Lexer(text)).expr()
+        return {'terms': len(result.num.terms) + len(result.den.terms)}
+    return run
+
+@benchmark(2, 3, 4)
+def metric_ricci(n):
+    """Ricci tensor of the n-dimensional diagonal metric with
+    g_ii = 1 / (1 + c^2), c the previous coordinate."""
+    coords = 'txyz'[:n]
+    rows = [[interpreter.Frac() for j in range(n)] for i in range(n)]
+    for i in range(n):
+        rows[i][i] = interpreter.Frac(constant(1), constant(1) + variable(coords[i - 1]) ** 2)
+    def run():
+        metric = interpreter.Metric(coords, rows)
+        ricci = metric.ricci()
+        return {'terms': sum(interpreter.terms(value) for index,value in ricci.items())}
+    return run
+
+@benchmark(2, 3, 4)
+def tensor_inverse(n):
+    """Invert the symmetric tridiagonal n x n matrix with
+    g_ii = 1 / (1 + c^2), c the previous coordinate, and g_i,i+1 = c_i / 2."""
+    coords = 'txyz'[:n]
+    rows = [[interpreter.Frac() for j in range(n)] for i in range(n)]
+    for i in range(n):
+        rows[i][i] = interpreter.Frac(constant(1), constant(1) + variable(coords[i - 1]) ** 2)
+    for i in range(n - 1):
+        rows[i][i + 1] = rows[i + 1][i] = interpreter.Frac(variable(coords[i]), constant(2))
+    matrix = interpreter.Tensor.matrix(rows, symmetric = True)
+    def run():
+        inverse = matrix.inverse()
+        return {'terms': sum(interpreter.terms(value) for index,value in inverse.items())}
+    return run
+
+@benchmark(1000, 10000, 50000)
+def spi_simplify(n):
+    """Simplify an n-term sum of products with many like terms."""
+    tree = spi.Parser(spi.Lexer(' + '.join(f'{i % 7 + 1}*x{i % 97}*y{i % 13}'
+                                           for i in range(n)))).expr()
+    def run():
+        result = fresh_interpreter().evaluate(tree)
+        return {'nodes': nodes(result)}
+    return run
+
+@benchmark(10, 50, 200)
+def spi_product_derivative(n):
+    """Take & three times over a product of n factors."""
+    tree = spi.Parser(spi.Lexer('&&&(' + '*'.join(f'x{i}' for i in range(n)) + ')')).expr()
+    def run():
+        result = fresh_interpreter().evaluate(tree)
+        return {'nodes': nodes(result)}
+    return run
+
+@benchmark(10, 20, 40)
+def spi_partial_chain(n):
+    """Apply $_x n times to a product of n + 1 factors of x and y."""
+    text = '*'.join(['(x+y)'] * (n + 1))
+    for i in range(n):
+        text = f'$_x({text})'
+    tree = spi.Parser(spi.Lexer(text)).expr()
+    def run():
+        result = fresh_interpreter().evaluate(tree)
+        return {'nodes': nodes(result)}
+    return run
+
+@benchmark(100, 500, 1000)
+def spi_assignment_chain(n):
+    """Bind a chain of n variables, each defined from the previous one,
+    then rebind its head so that every binding is refreshed."""
+    program = spi.Parser(spi.Lexer('; '.join(
+        [f'a0 = x'] + [f'a{i} = a{i - 1}*x{i % 10} + {i}' for i in range(1, n)]))).parse()
+    rebind = spi.Parser(spi.Lexer('a0 = y + 1')).parse()
+    def run():
+        session = fresh_interpreter()
+        session.visit(program)
+        session.visit(rebind)
+        return {'nodes': nodes(session.GLOBAL_SCOPE[f'a{n - 1}'])}
+    return run
+
+@benchmark(1000, 10000)
+def spi_fork(n):
+    """Fork a session of n bindings 100 times and rebind a parameter in
+    each fork."""
+    base = fresh_interpreter()
+    base.visit(spi.Parser(spi.Lexer('; '.join(
+        [f'a{i} = x{i % 10}*y + {i}' for i in range(n)] + ['f = a0*k']))).parse())
+    rebinds = [spi.Parser(spi.Lexer(f'k = {i}')).parse() for i in range(100)]
+    def run():
+        values = set()
+        for rebind in rebinds:
+            session = base.fork()
+            session.visit(rebind)
+            values.add(session.GLOBAL_SCOPE['f'])
+        return {'bindings': len(base.GLOBAL_SCOPE), 'values': len(values)}
+    return run
+
+@benchmark(10000, 50000)
+def spi_parse(n):
+    """Lex and parse an n-term generated assignment."""
+    text = 'y = ' + ' + '.join(f'{i}*x{i % 300}*(z{i % 7} - w)/q' for i in range(n))
+    def run():
+        tree = spi.Parser(spi.Lexer(text)).parse()
+        return {'bytes': len(text), 'statements': len(tree.children)}
+    return run
+
+def measure(make, repeat):
+    """Return the best time, the peak memory and the counts of a workload."""
+    best = None
+    for i in range(repeat):
+        run = make()
+        start = time.perf_counter()
+        counts = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    run = make()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': best, 'peak': peak, 'counts': counts}
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Print the time and memory ratio of every result to the baseline."""
+    before = {(entry['name'], entry['size']): entry for entry in baseline['results']}
+    for entry in results:
+        old = before.get((entry['name'], entry['size']))
+        if old is None:
+            continue
+        print(f"{entry['name']:>24} {entry['size']:>7}  time x{entry['time'] / old['time']:.2f}"
+              f"  peak x{entry['peak'] / max(old['peak'], 1):.2f}", file = sys.stderr)
+
+def main():
+    argparser = argparse.ArgumentParser(description = 'Benchmark the calculus engines.')
+    argparser.add_argument('-k', '--select', default = '',
+                           help = 'only run benchmarks whose name contains this')
+    argparser.add_argument('-r', '--repeat', type = int, default = 3,
+                           help = 'timed runs per size; the best is kept')
+    argparser.add_argument('-q', '--quick', action = 'store_true',
+                           help = 'only run the smallest size of each benchmark')
+    argparser.add_argument('-o', '--output', help = 'write the JSON results here instead of stdout')
+    argparser.add_argument('-c', '--compare', help = 'JSON results of an earlier run to compare with')
+    args = argparser.parse_args()
+
+    results = []
+    for name,(function,sizes) in BENCHMARKS.items():
+        if args.select not in name:
+            continue
+        for size in sizes[:1] if args.quick else sizes:
+            entry = {'name': name, 'size': size}
+            entry.update(measure(lambda: function(size), args.repeat))
+            print(f"{name:>24} {size:>7}  {entry['time']:.4f}s  {entry['peak'] >> 10} KiB",
+                  file = sys.stderr)
+            results += [entry]
+
+    report = {'revision': revision(), 'python': platform.python_version(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent = 1)
+    else:
+        json.dump(report, sys.stdout, indent = 1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as stream:
+            compare(results, json.load(stream))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,137 +2,327 @@
 #
 # EOF (end-of-file) token is used to indicate that
 # there is no more input left for lexical analysis
-from math import gcd
-PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, EOF, FRAC, DERIV = (
-    'PLUS', 'MINUS', 'MUL','DIV', 'LPAREN', 'RPAREN', 'EOF', 'FRAC', 'DERIV'
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from heapq import heapify, heappop, heappush
+from math import comb, gcd, lcm
+import re
+
+from profiling import PROFILE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+PLUS, MINUS, MUL, DIV, POW, LPAREN, RPAREN, EOF, FRAC, DERIV = (
+    'PLUS', 'MINUS', 'MUL','DIV', 'POW', 'LPAREN', 'RPAREN', 'EOF', 'FRAC', 'DERIV'
 )
 
 
 
+# Monomials are packed into a single integer: the variable interned at
+# index i owns the EXP_BITS wide field starting at bit i * EXP_BITS, so
+# multiplying monomials is one integer addition. The top bit of every
+# field is kept clear and flags an exponent overflow.
+EXP_BITS = 32
+EXP_MASK = (1 << EXP_BITS) - 1
+VARIABLES = []
+INDICES = {}
+GUARD = 0
+# Poly ** n expands a sum of k terms directly, one multinomial coefficient
+# per composition of n into k parts, while there are at most this many
+# compositions; past that (when many products share a monomial, say) it
+# falls back to repeated squaring
+MULTINOMIAL_LIMIT = 1 << 17
+
+def index(char):
+    """Return the field index of a variable, interning it if needed."""
+    global GUARD
+    i = INDICES.get(char)
+    if i is None:
+        i = len(VARIABLES)
+        VARIABLES.append(char)
+        INDICES[char] = i
+        GUARD |= 1 << (i * EXP_BITS + EXP_BITS - 1)
+    return i
+
+def monomial(chars = (), nums = ()):
+    """Pack variable names and their exponents into a monomial key."""
+    key = 0
+    for char,num in zip(chars,nums):
+        if type(num) != int or num < 0:
+            raise Exception(f'invalid exponent: {num}')
+        key += num << (index(char) * EXP_BITS)
+    return key
+
+def unpack(key):
+    """Return the (chars, nums) of a monomial key, sorted by variable name."""
+    pairs = []
+    i = 0
+    while key:
+        num = key & EXP_MASK
+        if num:
+            pairs += [(VARIABLES[i],num)]
+        key >>= EXP_BITS
+        i += 1
+    pairs.sort()
+    return tuple(pair[0] for pair in pairs),tuple(pair[1] for pair in pairs)
+
 def isvalid(key):
-    if len(key) != 2:
-        return False
-    
-    if len(key[0]) != len(key[1]):
-        return False
-    
-    for chars in key[0]:
-        if type(chars) != str:
-            return False
-    
-    for nums in key[1]:
-        if type(nums) != int and type(nums) != float:
-            return False
-    
-    return True
+    return type(key) == int and key >= 0 and not key & GUARD
 
-def sort(key):
-    order = sorted(range(len(key[0])), key=lambda k: key[0][k])
-    charsaslist = []
-    numsaslist = []
-    
-    for i in order:
-        charsaslist += [key[0][i]]
-        numsaslist += [key[1][i]]
-        
-    return (tuple(charsaslist),tuple(numsaslist))
+def divisible(key, opp):
+    """Return whether monomial `opp` divides monomial `key`."""
+    return ((key | GUARD) - opp) & GUARD == GUARD
+
+# Terms are kept in graded reverse lexicographic order, highest first:
+# by total degree, then the term with the smaller exponent in the variable
+# interned last comes first, which among keys of equal degree is the
+# smaller key. DEGREE is the total degree of a key: 2^EXP_BITS is 1 modulo
+# EXP_MASK, so a key modulo EXP_MASK is the sum of its fields (while that
+# stays below EXP_MASK).
+DEGREE = EXP_MASK.__rmod__
+
+def descending(keys):
+    """Return monomial keys sorted into term order, highest first."""
+    keys = sorted(keys)
+    # stable, so keys of equal degree stay in ascending order
+    keys.sort(key = DEGREE, reverse = True)
+    return keys
 
-def prod(key):
+def printed(keys):
+    """Return monomial keys in the order they are printed in.
+
+    This is graded reverse lexicographic as well, but with the variables
+    ranked by name, so that the output does not depend on the order in
+    which a process happened to intern them.
+    """
+    exps = {key:dict(zip(*unpack(key))) for key in keys}
+    names = sorted({char for exp in exps.values() for char in exp}, reverse = True)
+    return sorted(exps, key = lambda key: (-sum(exps[key].values()),
+                                           [exps[key].get(name, 0) for name in names]))
+
+def ratio(a, b):
+    """Exact quotient of two coefficients, kept integral when possible."""
+    if type(a) == int and type(b) == int and a % b == 0:
+        return a // b
+    q = Fraction(a) / b
+    return q.numerator if q.denominator == 1 else q
+
+def prod(key, coeff = 1):
     ret = Poly()
+    chars,nums = unpack(key)
     
-    for i in range(len(key[0])):
-        newcharsaslist = [f'&{key[0][i]}']
-        newnumsaslist = [1]
-        
-        for j in range(len(key[0])):
-            if j == i:
-                newcharsaslist += [key[0][j]]
-                newnumsaslist += [key[1][j] - 1]
-            else:
-                newcharsaslist += [key[0][j]]
-                newnumsaslist += [key[1][j]]
-                
-        newkey = (tuple(newcharsaslist), tuple(newnumsaslist))
-        ret = ret + Poly({newkey:key[1][i]})
+    for i in range(len(chars)):
+        newkey = key - monomial((chars[i],),(1,)) + monomial((f'&{chars[i]}',),(1,))
+        ret += Poly({newkey:coeff * nums[i]}, canonical = True)
         
     return ret
         
 
     
 class Poly:
-    def __init__(self, terms = None):
+    def __init__(self, terms = None, canonical = False):
+        # canonical terms have valid keys and no zero coefficients, and
+        # are stored in term order (see descending)
         self.terms = terms if terms != None else {}
-        self.validate()
-        self.annihilate()
-        self.trim()
+        # compiled Horner form, built by horner() and dropped by in-place
+        # updates
+        self.form = None
+        if not canonical and self.terms:
+            self.validate()
+            self.trim()
+            self.arrange()
         
-    def __add__(self,opp):
-        terms = {}
+    def copy(self):
+        return Poly(dict(self.terms), canonical = True)
         
-        for key in self.terms.keys():
-            if key in opp.terms.keys():
-                terms[key] = self.terms[key] + opp.terms[key]
-            else: 
-                terms[key] = self.terms[key]
-                
-        for key in opp.terms.keys():
-            if key not in self.terms.keys():
-                terms[key] = opp.terms[key]
-                
-        return Poly(terms)
+    def __add__(self,opp):
+        ret = self.copy()
+        ret += opp
+        return ret
     
     def __sub__(self,opp):
-        terms = {}
+        ret = self.copy()
+        ret -= opp
+        return ret
+    
+    def __iadd__(self,opp):
+        return self.accumulate(opp, 1)
+    
+    def __isub__(self,opp):
+        return self.accumulate(opp, -1)
+    
+    def accumulate(self, opp, scale):
+        """Add scale * opp to this polynomial in place."""
+        if opp is self:
+            opp = opp.copy()
+        if scale == 1:
+            return self.merge(opp.terms.items())
+        return self.merge([(key,scale * value) for key,value in opp.terms.items()])
+    
+    def merge(self, items):
+        """Add (key, value) pairs given in term order, in place.
+
+        Terms already present are updated where they stand; the others are
+        merged in with a single pass over both sequences.
+        """
+        self.form = None
+        terms = self.terms
+        new = []
+        zeros = []
+        for key,value in items:
+            old = terms.get(key)
+            if old is None:
+                if value != 0:
+                    new += [(key,value)]
+            else:
+                old += value
+                terms[key] = old
+                if old == 0:
+                    zeros += [key]
+                    
+        for key in zeros:
+            terms.pop(key)
+        if not new:
+            return self
+        if not terms:
+            self.terms = dict(new)
+            return self
         
-        for key in self.terms.keys():
-            if key in opp.terms.keys():
-                terms[key] = self.terms[key] - opp.terms[key]
-            else: 
-                terms[key] = self.terms[key]
-                
-        for key in opp.terms.keys():
-            if key not in self.terms.keys():
-                terms[key] = - opp.terms[key]
-                
-        return Poly(terms)
+        merged = {}
+        pending = iter(new)
+        key,value = next(pending)
+        degree = key % EXP_MASK
+        rest = iter(terms.items())
+        for okey,ovalue in rest:
+            odegree = okey % EXP_MASK
+            while degree > odegree or degree == odegree and key < okey:
+                merged[key] = value
+                item = next(pending, None)
+                if item is None:
+                    # no new terms left: the rest of the terms follows as is
+                    degree = -1
+                    break
+                key,value = item
+                degree = key % EXP_MASK
+            merged[okey] = ovalue
+            if degree < 0:
+                break
+        merged.update(rest)
+        if degree >= 0:
+            merged[key] = value
+            merged.update(pending)
+        self.terms = merged
+        return self
+    
+    def addmul(self, a, b, scale = 1):
+        """Add scale * a * b to this polynomial in place.
 
-    def __mul__(self,opp):
+        The product is collected on its own, put in term order and merged.
+        Multiplying by a single term keeps the order, so then there is
+        nothing to sort.
+        """
         terms = {}
-        
-        for selfkey in self.terms.keys():
-            for oppkey in opp.terms.keys():
-                newkey = sort([list(selfkey[0]) + list(oppkey[0]),list(selfkey[1]) + list(oppkey[1])])
-                
-                if newkey in terms.keys():
-                    terms[newkey] += self.terms[selfkey] * opp.terms[oppkey]
+        for akey,avalue in a.terms.items():
+            avalue = scale * avalue
+            for bkey,bvalue in b.terms.items():
+                key = akey + bkey
+                value = terms.get(key)
+                if value is None:
+                    if key & GUARD:
+                        raise Exception(f'exponent overflow: {unpack(key)}')
+                    terms[key] = avalue * bvalue
                 else:
-                    terms[newkey] = self.terms[selfkey] * opp.terms[oppkey]
+                    terms[key] = value + avalue * bvalue
                     
-        return Poly(terms)
+        keys = terms if len(a.terms) == 1 or len(b.terms) == 1 else descending(terms)
+        if not self.terms:
+            self.form = None
+            self.terms = {key:terms[key] for key in keys if terms[key] != 0}
+            return self
+        return self.merge([(key,terms[key]) for key in keys])
+
+    def __mul__(self,opp):
+        return Poly().addmul(self,opp)
+    
+    def __pow__(self, n):
+        if type(n) != int or n < 0:
+            raise Exception(f'invalid exponent: {n}')
+        if n == 0:
+            return Poly({monomial():1}, canonical = True)
+        if not self.terms:
+            return Poly()
+        if max([self.degree(i) for i in range(self.mainvar() + 1)] or [0]) * n >> (EXP_BITS - 1):
+            raise Exception(f'exponent overflow: {self} ^ {n}')
+        if len(self.terms) == 1:
+            key,value = next(iter(self.terms.items()))
+            return Poly({key * n:value ** n}, canonical = True)
+        if comb(n + len(self.terms) - 1, len(self.terms) - 1) <= MULTINOMIAL_LIMIT:
+            return self.multinomial(n)
+        
+        ret = None
+        base = self
+        while True:
+            if n & 1:
+                ret = base if ret is None else ret * base
+            n >>= 1
+            if not n:
+                return ret.copy() if ret is self else ret
+            base = base * base
+    
+    def multinomial(self, n):
+        """Expand self ** n as the sum over the compositions of n.
+
+        The term for exponents k1 + ... + km = n is
+        n! / (k1! ... km!) * (c1 t1)^k1 ... (cm tm)^km; the coefficient is
+        built up as a product of binomials while the exponents are chosen
+        term by term.
+        """
+        items = list(self.terms.items())
+        last = len(items) - 1
+        terms = {}
+        # (term index, exponent left, coefficient, key) of partial choices
+        stack = [(0, n, 1, 0)]
+        while stack:
+            i,left,coeff,key = stack.pop()
+            tkey,tvalue = items[i]
+            if i == last:
+                key += left * tkey
+                terms[key] = terms.get(key, 0) + coeff * tvalue ** left
+                continue
+            power = 1
+            for num in range(left + 1):
+                stack += [(i + 1, left - num, coeff * comb(left, num) * power, key + num * tkey)]
+                power *= tvalue
+                
+        # the keys are sums of valid keys, checked for overflow by __pow__
+        return Poly({key:terms[key] for key in descending(terms) if terms[key] != 0}, canonical = True)
     
     def __str__(self):
         ret = ''
-        for n,key in enumerate(self.terms.keys()):
-            coeff = int(self.terms[key]) if int(self.terms[key] % 1*1000) == 0 else self.terms[key]
+        for n,key in enumerate(printed(self.terms)):
+            chars,nums = unpack(key)
+            coeff = int(self.terms[key]) if self.terms[key].denominator == 1 else self.terms[key]
             if n > 0:
                 ret += ' + ' if coeff >= 0 else ' - '
-                ret += str(abs(coeff)) if abs(self.terms[key]) != 1 or len(key[0]) == 0 else ''
+                ret += str(abs(coeff)) if abs(self.terms[key]) != 1 or len(chars) == 0 else ''
 
             else:
                 ret += '' if coeff >= 0 else '-'
                 ret += str(abs(coeff)) 
 
-            for i in range(len(key[0])):
-                if key[0][i][0] != '&':
-                    if key[1][i] == 1:
-                        ret += f'{key[0][i]}'
-                    elif key[1][i] != 0:
-                        ret += f'{key[0][i]}^{key[1][i]}'
+            for i in range(len(chars)):
+                if chars[i][0] != '&':
+                    if nums[i] == 1:
+                        ret += f'{chars[i]}'
+                    elif nums[i] != 0:
+                        ret += f'{chars[i]}^{nums[i]}'
                 else:
-                    if key[1][i] == 1:
-                        ret += f'({key[0][i]})'
-                    elif key[1][i] != 0:
-                        ret += f'({key[0][i]})^{key[1][i]}'
+                    if nums[i] == 1:
+                        ret += f'({chars[i]})'
+                    elif nums[i] != 0:
+                        ret += f'({chars[i]})^{nums[i]}'
                     
             
                 
@@ -160,127 +350,331 @@ class Poly:
             if not isvalid(key):
                 raise Exception(f'invalid key: {key}')
                 
-    def annihilate(self):
-        copyterms = self.terms.copy()
-        
-        for key in copyterms.keys():
-            newcharslist = []
-            newnumslist = []
-            
-            for i in range(len(key[0])):
-                if key[0][i] not in newcharslist:
-                    newcharslist += [key[0][i]]
-                    newnumslist += [key[1][i]]
-                else:
-                    j = newcharslist.index(key[0][i])
-                    newnumslist[j] += key[1][i]
-                    
-            newkey = sort([newcharslist,newnumslist])
-            if newkey != key:
-                self.terms.pop(key)
-                self.terms[newkey] = copyterms[key]
-         
     def trim(self):
-        copyterms = self.terms.copy()
-        
-        for key in copyterms.keys():
-            newcharslist = []
-            newnumslist = []
-            
-            for i in range(len(key[0])):
-                if key[1][i] != 0:
-                    newcharslist += [key[0][i]]
-                    newnumslist += [key[1][i]]
-                
-            newkey = sort((tuple(newcharslist),tuple(newnumslist)))
-            if newkey != key or copyterms[key] == 0:
+        for key in list(self.terms.keys()):
+            if self.terms[key] == 0:
                 self.terms.pop(key)
-                if copyterms[key] != 0:
-                    self.terms[newkey] = copyterms[key]
+                
+    def arrange(self):
+        """Put the terms in term order."""
+        terms = self.terms
+        if len(terms) > 1:
+            self.terms = {key:terms[key] for key in descending(terms)}
                     
     def derive(self):
-        ret = Poly()
-        
-        for key in self.terms.keys():
-            ret = ret + prod(key) * Poly({((),()):self.terms[key]})
+        terms = {}
+        for key,value in self.terms.items():
+            for pkey,pvalue in prod(key, value).terms.items():
+                terms[pkey] = terms.get(pkey, 0) + pvalue
             
+        return Poly(terms)
+    
+    def partial(self, char):
+        """Return the partial derivative with respect to variable char."""
+        i = INDICES.get(char)
+        if i is None:
+            return Poly()
+        shift = i * EXP_BITS
+        terms = {}
+        for key,value in self.terms.items():
+            num = (key >> shift) & EXP_MASK
+            if num:
+                terms[key - (1 << shift)] = num * value
+        return Poly(terms, canonical = True)
+    
+    def depends(self, char):
+        """Return whether variable char occurs in any term."""
+        i = INDICES.get(char)
+        return i is not None and self.degree(i) > 0
+    
+    def __getstate__(self):
+        # keys are only meaningful within one process, so a pickled Poly
+        # spells its monomials out by variable name
+        return [(unpack(key),value) for key,value in self.terms.items()]
+    
+    def __setstate__(self, state):
+        self.terms = {monomial(chars,nums):value for (chars,nums),value in state}
+        self.form = None
+        # the order of keys of equal degree follows this process's interning
+        self.arrange()
+    
+    def lead(self):
+        """Return the leading monomial, the first in term order."""
+        return next(iter(self.terms))
+    
+    def mainvar(self):
+        """Return the highest variable index present, or -1 if constant."""
+        keys = 0
+        for key in self.terms:
+            keys |= key
+        return (keys.bit_length() - 1) // EXP_BITS if keys else -1
+    
+    def degree(self, i):
+        shift = i * EXP_BITS
+        return max([(key >> shift) & EXP_MASK for key in self.terms] or [0])
+    
+    def coefficients(self, i):
+        """Split into {exponent: Poly} by the exponent of variable i."""
+        shift = i * EXP_BITS
+        ret = {}
+        for key,value in self.terms.items():
+            num = (key >> shift) & EXP_MASK
+            part = ret.get(num)
+            if part is None:
+                part = ret[num] = Poly(canonical = True)
+            part.terms[key - (num << shift)] = value
         return ret
     
-    def hasfactor(self):
-        rfacs = []
-        rpwrs = []
-        keyslist = list(self.terms.keys())
-        if len(keyslist) < 1:
-            return rfacs,rpwrs
-        
-        
-        chars = keyslist[0][0]
-        nums = keyslist[0][1]
-        
-        for j in range(len(chars)):
-            n = 1
-            cpow = nums[j]
-            for i in range(1,len(keyslist)):
-                if chars[j] in keyslist[i][0]:
-                    n += 1
-                    ind = keyslist[i][0].index(chars[j])
-                    if abs(keyslist[i][1][ind]) < abs(cpow):
-                        cpow = keyslist[i][1][ind]
-                    continue
-                else:
-                    break
-            if n == len(keyslist):
-                rfacs += [chars[j]]
-                rpwrs += [cpow]
-            
-        return rfacs,rpwrs
+    def scale(self, coeff, key = 0):
+        """Return coeff * key * self for a coefficient and a monomial key."""
+        return Poly({k + key:coeff * v for k,v in self.terms.items()}, canonical = coeff != 0)
+    
+    def normal(self):
+        """Return the associate with a positive leading coefficient."""
+        if self.terms and self.terms[self.lead()] < 0:
+            return self.scale(-1)
+        return self
     
-    def factor(self,charnum):
-        char,num = charnum
-        copyterms = self.terms.copy()
+    def divide(self, opp):
+        """Return (quotient, remainder) of multivariate division by opp."""
+        if not opp.terms:
+            raise ZeroDivisionError('polynomial division by zero')
+        lead = opp.lead()
+        lc = opp.terms[lead]
+        rest = list(opp.terms.items())[1:]
         
-        for key in copyterms.keys():
-            newcharslist = []
-            newnumslist = []
+        # the heap pops keys in term order: highest degree, then lowest key
+        work = dict(self.terms)
+        heap = [(-(key % EXP_MASK),key) for key in work]
+        heapify(heap)
+        quot = {}
+        rem = {}
+        while heap:
+            key = heappop(heap)[1]
+            value = work.pop(key, 0)
+            if value == 0:
+                continue
+            if not divisible(key, lead):
+                rem[key] = value
+                continue
             
-            if char in key[0]:
-                for i in range(len(key[0])):
-                    newcharslist += [key[0][i]]
-                    newnumslist += [key[1][i] - num] if key[0][i] == char else [key[1][i]]
-                
-                newkey = (tuple(newcharslist),tuple(newnumslist))
-                self.terms.pop(key)
-                self.terms[newkey] = copyterms[key]
-                
-            else:
-                raise Exception(f'bad factor: {char}')
-             
-        self.validate()
-        self.annihilate()
-        self.trim()
-                
+            coeff = ratio(value, lc)
+            qkey = key - lead
+            quot[qkey] = coeff
+            for okey,ovalue in rest:
+                newkey = qkey + okey
+                if newkey not in work:
+                    heappush(heap, (-(newkey % EXP_MASK),newkey))
+                work[newkey] = work.get(newkey, 0) - coeff * ovalue
                 
+        return Poly(quot, canonical = True),Poly(rem, canonical = True)
+    
+    def prem(self, opp, i):
+        """Pseudo-remainder of division by opp as polynomials in variable i."""
+        shift = i * EXP_BITS
+        db = opp.degree(i)
+        lcb = opp.coefficients(i)[db]
+        rem = self.copy()
+        while rem.terms:
+            dr = rem.degree(i)
+            if dr < db:
+                break
+            lcr = rem.coefficients(i)[dr]
+            rem = lcb * rem
+            rem.addmul(lcr.scale(1, (dr - db) << shift), opp, -1)
+        return rem
+    
+    def primitive(self, i):
+        """Return (content, primitive part) with respect to variable i."""
+        coeffs = list(self.coefficients(i).values())
+        content = coeffs[0]
+        for coeff in coeffs[1:]:
+            content = content.gcd(coeff)
+        return content,self.divide(content)[0]
+    
+    def gcd(self, opp):
+        """Greatest common divisor over the integers.
+
+        Uses the primitive polynomial remainder sequence in the main
+        variable and recurses on the contents in the other variables. The
+        result has a positive leading coefficient.
+        """
+        a,b = self,opp
+        if not a.terms:
+            return b.normal()
+        if not b.terms:
+            return a.normal()
+        if len(b.terms) < len(a.terms):
+            a,b = b,a
+        if len(a.terms) == 1:
+            return a.termgcd(b)
         
+        i = max(a.mainvar(), b.mainvar())
+        ca,pa = a.primitive(i)
+        cb,pb = b.primitive(i)
+        content = ca.gcd(cb)
+        if pa.degree(i) < pb.degree(i):
+            pa,pb = pb,pa
+            
+        while pb.degree(i) > 0:
+            rem = pa.prem(pb, i)
+            if not rem.terms:
+                return (content * pb).normal()
+            pa,pb = pb,rem.primitive(i)[1]
+            
+        return content.normal()
+    
+    def termgcd(self, opp):
+        """gcd of a single-term polynomial with opp."""
+        key,value = next(iter(self.terms.items()))
+        coeffs = [value]
+        for okey,ovalue in opp.terms.items():
+            coeffs += [ovalue]
+            common = 0
+            for i in range(self.mainvar() + 1):
+                shift = i * EXP_BITS
+                common += min((key >> shift) & EXP_MASK,(okey >> shift) & EXP_MASK) << shift
+            key = common
+            
+        if all(type(coeff) == int for coeff in coeffs):
+            value = gcd(*coeffs)
+        else:
+            value = 1
+        return Poly({key:value}, canonical = True)
         
+    def evaluate(self, values):
+        """Evaluate at every point of the arrays in `values` at once.
+
+        `values` maps variable names to NumPy arrays (or scalars) of
+        broadcastable shapes. Powers are tabulated once per variable and
+        the terms are summed in term order with in-place updates, so the
+        result is reproducible bit for bit.
+        """
+        if np is None:
+            raise ImportError('Poly.evaluate requires numpy')
+        
+        tables = []
+        for i in range(self.mainvar() + 1):
+            top = self.degree(i)
+            if top == 0:
+                continue
+            if VARIABLES[i] not in values:
+                raise Exception(f'no value for variable {VARIABLES[i]}')
+            base = np.asarray(values[VARIABLES[i]], dtype = float)
+            table = [None,base]
+            for num in range(2, top + 1):
+                table += [table[num - 1] * base]
+            tables += [(i * EXP_BITS,table)]
+            
+        arrays = [np.asarray(value, dtype = float) for value in values.values()]
+        shape = np.broadcast_shapes(*[array.shape for array in arrays])
+        total = np.zeros(shape)
+        term = np.empty(shape)
+        for key,value in self.terms.items():
+            term.fill(float(value))
+            for shift,table in tables:
+                num = (key >> shift) & EXP_MASK
+                if num:
+                    np.multiply(term, table[num], out = term)
+            np.add(total, term, out = total)
+            
+        return total
+        
+    def horner(self):
+        """Return this polynomial compiled to a multivariate Horner form.
+
+        The function takes the values of the variables in its `names`, in
+        that order. Each level splits off the variable that occurs in the
+        most terms and nests its powers, with the coefficients in the
+        remaining variables nested the same way, so an evaluation is a
+        chain of multiply-adds. The form is built once and kept until the
+        polynomial is changed in place.
+        """
+        if self.form is not None:
+            return self.form
+        indices = [i for i in range(self.mainvar() + 1) if self.degree(i)]
+        lines = []
+        temps = []
+        
+        def nest(poly):
+            if not poly.terms:
+                return '0'
+            if list(poly.terms) == [0]:
+                return repr(poly.terms[0])
+            i = max(indices, key = lambda i: sum(1 for key in poly.terms if (key >> (i * EXP_BITS)) & EXP_MASK))
+            parts = poly.coefficients(i)
+            nums = sorted(parts, reverse = True)
+            local = f'_h{len(temps)}'
+            temps.append(local)
+            lines.append(f'{local} = {nest(parts[nums[0]])}')
+            for num,lower in zip(nums, nums[1:] + [0]):
+                if num == lower:
+                    continue
+                power = f'_x{i}' if num - lower == 1 else f'_x{i}**{num - lower}'
+                if lower in parts:
+                    lines.append(f'{local} = {local}*{power} + {nest(parts[lower])}')
+                else:
+                    lines.append(f'{local} = {local}*{power}')
+            return local
+        
+        root = nest(self)
+        source = f'def horner({", ".join(f"_x{i}" for i in indices)}):\n'
+        source += ''.join(f'    {line}\n' for line in lines)
+        source += f'    return {root}\n'
+        namespace = {'Fraction': Fraction}
+        exec(source, namespace)
+        self.form = namespace['horner']
+        self.form.names = tuple(VARIABLES[i] for i in indices)
+        self.form.source = source
+        return self.form
+    
+    def subs(self, values):
+        """Return the value at a point, given as a dict from variable names
+        to numbers; exact for int and Fraction values."""
+        form = self.horner()
+        args = []
+        for name in form.names:
+            if name not in values:
+                raise Exception(f'no value for variable {name}')
+            args += [values[name]]
+        return form(*args)
 
 class Frac:
     def __init__(self,num = None, den = None):
         self.num = num if num != None else Poly()
-        self.den = den if den != None else Poly()
+        self.den = den if den != None else Poly({monomial():1})
         self.annihilate()
         
     def __add__(self,opp):
-        num = self.num * opp.den + opp.num * self.den
+        num = self.num * opp.den
+        num.addmul(opp.num,self.den)
         den = self.den * opp.den
         
         return Frac(num,den)
     
     def __sub__(self,opp):
-        num = self.num * opp.den - opp.num * self.den
+        num = self.num * opp.den
+        num.addmul(opp.num,self.den,-1)
         den = self.den * opp.den
         
         return Frac(num,den)
     
+    def __iadd__(self,opp):
+        num = self.num * opp.den
+        num.addmul(opp.num,self.den)
+        self.num = num
+        self.den = self.den * opp.den
+        self.annihilate()
+        return self
+    
+    def __isub__(self,opp):
+        num = self.num * opp.den
+        num.addmul(opp.num,self.den,-1)
+        self.num = num
+        self.den = self.den * opp.den
+        self.annihilate()
+        return self
+    
     def __mul__(self,opp):
         num = self.num * opp.num
         den = self.den * opp.den
@@ -293,6 +687,27 @@ class Frac:
         
         return Frac(num,den)
     
+    def __pow__(self, n):
+        """Integer power; negative exponents invert.
+
+        Powers of coprime polynomials are coprime, so the result is built
+        already in lowest terms.
+        """
+        if type(n) != int:
+            raise Exception(f'invalid exponent: {n}')
+        num,den = self.num,self.den
+        if n < 0:
+            if not num.terms:
+                raise ZeroDivisionError('fraction with zero denominator')
+            num,den,n = den,num,-n
+        ret = Frac.__new__(Frac)
+        ret.num = num ** n
+        ret.den = den ** n
+        if ret.den.terms[ret.den.lead()] < 0:
+            ret.num = ret.num.scale(-1)
+            ret.den = ret.den.scale(-1)
+        return ret
+    
     def __str__(self):
         strnum = str(self.num)
         strden = str(self.den) 
@@ -307,57 +722,412 @@ class Frac:
         return ret
         
     def derive(self):
-        num = self.den * self.num.derive() - self.den.derive() * self.num
+        num = self.den * self.num.derive()
+        num.addmul(self.den.derive(),self.num,-1)
+        den = self.den * self.den
+        
+        return Frac(num,den)
+    
+    def partial(self, char):
+        """Return the partial derivative with respect to variable char."""
+        if not self.depends(char):
+            return Frac()
+        num = self.den * self.num.partial(char)
+        num.addmul(self.den.partial(char),self.num,-1)
         den = self.den * self.den
         
         return Frac(num,den)
     
+    def depends(self, char):
+        return self.num.depends(char) or self.den.depends(char)
+    
+    def iszero(self):
+        return not self.num.terms
+    
+    def __neg__(self):
+        ret = Frac.__new__(Frac)
+        ret.num = self.num.scale(-1)
+        ret.den = self.den
+        return ret
+    
+    def __setstate__(self, state):
+        # the leading term depends on the order in which this process
+        # interned the variables, so the sign is normalized again
+        self.__dict__.update(state)
+        if self.den.terms[self.den.lead()] < 0:
+            self.num = self.num.scale(-1)
+            self.den = self.den.scale(-1)
+        
+    def subs(self, values):
+        """Return the value at a point, see Poly.subs."""
+        num = self.num.subs(values)
+        den = self.den.subs(values)
+        if isinstance(num,(int,Fraction)) and isinstance(den,(int,Fraction)):
+            return ratio(num, den)
+        return num / den
+    
+    def evaluate(self, values):
+        """Evaluate at every point of the arrays in `values`, see Poly.evaluate."""
+        return self.num.evaluate(values) / self.den.evaluate(values)
+        
     def annihilate(self):
-        numslist = []
-        dofactor = True
+        """Cancel the polynomial gcd of numerator and denominator.
+
+        Coefficients are exact; both sides are scaled to integer
+        coefficients with no common factor and a positive leading
+        denominator coefficient.
+        """
+        if not self.den.terms:
+            raise ZeroDivisionError('fraction with zero denominator')
+        if not self.num.terms:
+            self.den = Poly({monomial():1}, canonical = True)
+            return
         
-        for key in self.num.terms.keys():
-            coeff = round(self.num.terms[key],3)
-            if coeff % 1 * 1000 == 0:
-                numslist += [round(self.num.terms[key])]
-            else:
-                dofactor = False
-                break
+        dens = [getattr(value, 'denominator', 1) for value in self.num.terms.values()]
+        dens += [getattr(value, 'denominator', 1) for value in self.den.terms.values()]
+        mult = lcm(*dens)
+        if mult != 1:
+            self.num = self.num.scale(mult)
+            self.den = self.den.scale(mult)
             
-        if dofactor:
-            for key in self.den.terms.keys():
-                coeff = round(self.den.terms[key],3)
-                if coeff % 1 * 1000 == 0:
-                    numslist += [round(self.den.terms[key])]
-                else:
-                    dofactor = False
-                    break
-            
-        if dofactor:
-             div = gcd(*numslist)
+        div = self.num.gcd(self.den)
+        if self.den.terms[self.den.lead()] < 0:
+            div = div.scale(-1)
+        if div.terms != {0:1}:
+            self.num = self.num.divide(div)[0]
+            self.den = self.den.divide(div)[0]
         
-        for key in self.num.terms.keys():
-            self.num.terms[key] /= div
-            
-        for key in self.den.terms.keys():
-            self.den.terms[key] /= div
+
+
+def constant(value):
+    value = Fraction(value)
+    return Frac(Poly({monomial():value.numerator}),Poly({monomial():value.denominator}))
+
+def contract(terms):
+    """Return the sum of scale * a * b over (scale, a, b) in terms."""
+    ret = Frac()
+    for scale,a,b in terms:
+        ret += constant(scale) * a * b
+    return ret
+
+def partials(value, chars):
+    """Return the partial derivatives of value by each of chars."""
+    return [value.partial(char) for char in chars]
+
+
+class Tensor:
+    """Sparse tensor of Frac components in n dimensions.
+
+    Only nonzero components are stored, each under one canonical index.
+    `symmetries` lists (a, b, sign) triples: swapping the indices at
+    positions a and b multiplies a component by sign, so of the two only
+    the one with index[a] <= index[b] is kept, and for sign -1 the
+    components with index[a] == index[b] are zero.
+    """
+    def __init__(self, n, rank, symmetries = ()):
+        self.n = n
+        self.rank = rank
+        self.symmetries = tuple(symmetries)
+        # canonical index -> nonzero Frac
+        self.components = {}
+        
+    @classmethod
+    def matrix(cls, rows, symmetric = False):
+        n = len(rows)
+        if any(len(row) != n for row in rows):
+            raise Exception(f'a matrix needs {n} x {n} components')
+        ret = cls(n, 2, [(0,1,1)] if symmetric else ())
+        for i in range(n):
+            for j in range(i if symmetric else 0, n):
+                if symmetric:
+                    a,b = rows[i][j],rows[j][i]
+                    if a.num != b.num or a.den != b.den:
+                        raise Exception(f'matrix is not symmetric in {i}, {j}')
+                ret[i,j] = rows[i][j]
+        return ret
+    
+    def canonical(self, index):
+        """Return (canonical index, sign); the sign is 0 for a component
+        that vanishes by antisymmetry."""
+        index = list(index)
+        sign = 1
+        swapped = True
+        while swapped:
+            swapped = False
+            for a,b,flip in self.symmetries:
+                if index[a] > index[b]:
+                    index[a],index[b] = index[b],index[a]
+                    sign *= flip
+                    swapped = True
+                elif index[a] == index[b] and flip < 0:
+                    return tuple(index),0
+        return tuple(index),sign
+    
+    def __getitem__(self, index):
+        index,sign = self.canonical(index)
+        value = self.components.get(index) if sign else None
+        if value is None:
+            return Frac()
+        return value if sign > 0 else -value
+    
+    def __setitem__(self, index, value):
+        index,sign = self.canonical(index)
+        if value.iszero():
+            self.components.pop(index, None)
+        elif not sign:
+            raise Exception(f'component {index} is zero by antisymmetry')
+        else:
+            self.components[index] = value if sign > 0 else -value
             
-        numfacs,numpwrs = self.num.hasfactor()
-        denfacs,denpwrs = self.den.hasfactor()
+    def __contains__(self, index):
+        index,sign = self.canonical(index)
+        return sign != 0 and index in self.components
+    
+    def __len__(self):
+        return len(self.components)
+    
+    def items(self):
+        return self.components.items()
+    
+    def polynomial_rows(self):
+        """Return (rows, dens) with row i of this matrix = rows[i] / dens[i].
+
+        dens[i] is the lcm of the denominators in row i, so rows holds
+        plain polynomials.
+        """
+        rows = []
+        dens = []
+        for i in range(self.n):
+            row = [self[i,j] for j in range(self.n)]
+            den = Poly({monomial():1}, canonical = True)
+            for value in row:
+                if value.den.terms != {0:1}:
+                    den = den * value.den.divide(den.gcd(value.den))[0]
+            rows += [[value.num * den.divide(value.den)[0] if not value.iszero() else Poly()
+                      for value in row]]
+            dens += [den]
+        return rows,dens
+    
+    def eliminate(self):
+        """Fraction-free (Bareiss) Gauss-Jordan elimination.
+
+        Returns (sign, d, adj, dens): with P the polynomial rows and dens
+        their denominators, d = sign * det(P) and P^-1 = adj / d. Each
+        step divides exactly by the previous pivot, so every entry stays
+        a polynomial no larger than a minor of P.
+        """
+        if self.rank != 2:
+            raise Exception('only a matrix has a determinant')
+        n = self.n
+        rows,dens = self.polynomial_rows()
+        for i in range(n):
+            rows[i] += [Poly({monomial():1}, canonical = True) if i == j else Poly() for j in range(n)]
+        sign = 1
+        prev = Poly({monomial():1}, canonical = True)
+        for k in range(n):
+            candidates = [r for r in range(k, n) if rows[r][k].terms]
+            if not candidates:
+                return 1,Poly(),None,dens
+            # the smallest pivot keeps the products small
+            pivot = min(candidates, key = lambda r: len(rows[r][k].terms))
+            if pivot != k:
+                rows[k],rows[pivot] = rows[pivot],rows[k]
+                sign = -sign
+            top = rows[k]
+            for i in range(n):
+                if i == k:
+                    continue
+                row = rows[i]
+                factor = row[k]
+                for j in range(2 * n):
+                    if j == k:
+                        continue
+                    value = top[k] * row[j]
+                    if factor.terms and top[j].terms:
+                        value.addmul(factor, top[j], -1)
+                    if value.terms and prev.terms != {0:1}:
+                        value,rem = value.divide(prev)
+                        if rem.terms:
+                            raise Exception('inexact division in fraction-free elimination')
+                    row[j] = value
+                row[k] = Poly()
+            prev = top[k]
+        return sign,prev,[row[n:] for row in rows],dens
+    
+    def det(self):
+        sign,d,adj,dens = self.eliminate()
+        den = Poly({monomial():1}, canonical = True)
+        for value in dens:
+            den = den * value
+        return Frac(d.scale(sign), den)
+    
+    def inverse(self):
+        """Return the inverse matrix, with the symmetry of this one."""
+        sign,d,adj,dens = self.eliminate()
+        if not d.terms:
+            raise Exception('matrix is singular')
+        # with P = diag(dens) M, M^-1 = P^-1 diag(dens)
+        ret = Tensor(self.n, 2, self.symmetries)
+        for i in range(self.n):
+            for j in range(i if self.symmetries else 0, self.n):
+                if adj[i][j].terms:
+                    ret[i,j] = Frac(adj[i][j] * dens[j], d)
+        return ret
+
+
+class Metric:
+    """Christoffel symbols and curvature of a metric g_ij.
+
+    Components are Fracs in the coordinate variables, held in Tensors.
+    Every derivative d_k g_ij is taken once; only i <= j of a symmetric
+    index pair and m < n of the antisymmetric pair of the Riemann tensor
+    are computed, components that are zero are not stored, and a
+    derivative of a component that does not involve the coordinate is not
+    taken. With workers > 1 the components of each stage are computed on
+    a process pool.
+    """
+    def __init__(self, coords, rows, workers = None):
+        self.coords = tuple(coords)
+        self.n = len(self.coords)
+        if len(rows) != self.n:
+            raise Exception(f'a metric in {self.n} coordinates needs {self.n} x {self.n} components')
+        self.g = Tensor.matrix(rows, symmetric = True)
+        self.workers = workers
+        self.pool = None
+        # stages, computed on first use: d_k g_ij, g^ij, Gamma^k_ij,
+        # d_m Gamma^k_ij, R^r_smn and R_sn
+        self.dg = None
+        self.ginv = None
+        self.gamma = None
+        self.dgamma = None
+        self.rm = None
+        self.rc = None
         
-        for i in range(len(numfacs)):
-            if numfacs[i] in denfacs:
-                ind = denfacs.index(numfacs[i])
-                mpwr = min(denpwrs[ind],numpwrs[i])
-                
-                self.num.factor((numfacs[i],mpwr))
-                self.den.factor((numfacs[i],mpwr))
-                
-   
-        if self.num.terms == self.den.terms:
-            self.num = Poly({((),()):1})
-            self.den = Poly({((),()):1})
+    def map(self, function, tasks):
+        """Return [function(*task) for task in tasks], on the pool if any."""
+        if self.workers is None or self.workers < 2 or len(tasks) < 2:
+            return [function(*task) for task in tasks]
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        chunk = max(1, len(tasks) // (4 * self.workers))
+        return list(self.pool.map(function, *zip(*tasks), chunksize = chunk))
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+    
+    def differentiate(self, tensor):
+        """Return the tensor d_k T with the derivative index first."""
+        ret = Tensor(self.n, tensor.rank + 1, [(a + 1,b + 1,sign) for a,b,sign in tensor.symmetries])
+        entries = list(tensor.items())
+        tasks = [(value,[char for char in self.coords if value.depends(char)]) for index,value in entries]
+        for (index,value),(value,chars),values in zip(entries, tasks, self.map(partials, tasks)):
+            for char,derivative in zip(chars,values):
+                ret[(self.coords.index(char),) + index] = derivative
+        return ret
+    
+    def collect(self, tensor, indices, tasks):
+        """Store contract(terms) for every (index, terms) into tensor."""
+        for index,value in zip(indices, self.map(contract, tasks)):
+            tensor[index] = value
+        return tensor
         
+    def metric_derivatives(self):
+        if self.dg is None:
+            self.dg = self.differentiate(self.g)
+        return self.dg
+        
+    def inverse(self):
+        """Return g^ij, by fraction-free elimination."""
+        if self.ginv is None:
+            self.ginv = self.g.inverse()
+        return self.ginv
+    
+    def det(self):
+        return self.g.det()
+    
+    def christoffel(self):
+        """Return Gamma^k_ij = g^kl [ij,l], symmetric in i and j.
+
+        [ij,l] = (d_i g_jl + d_j g_il - d_l g_ij) / 2 is the symbol of the
+        first kind.
+        """
+        if self.gamma is not None:
+            return self.gamma
+        dg = self.metric_derivatives()
+        ginv = self.inverse()
+        n = self.n
+        half = Fraction(1, 2)
+        one = constant(1)
+        first = Tensor(n, 3, [(0,1,1)])
+        for i in range(n):
+            for j in range(i, n):
+                for l in range(n):
+                    terms = [(scale,dg[index],one) for scale,index in ((half,(i,j,l)),
+                                                                      (half,(j,i,l)),
+                                                                      (-half,(l,i,j)))
+                             if index in dg]
+                    if terms:
+                        first[i,j,l] = contract(terms)
+                        
+        indices = []
+        tasks = []
+        for k in range(n):
+            for i in range(n):
+                for j in range(i, n):
+                    terms = [(1,ginv[k,l],first[i,j,l]) for l in range(n)
+                             if (i,j,l) in first and (k,l) in ginv]
+                    if terms:
+                        indices += [(k,i,j)]
+                        tasks += [(terms,)]
+        self.gamma = self.collect(Tensor(n, 3, [(1,2,1)]), indices, tasks)
+        return self.gamma
+    
+    def riemann(self):
+        """Return R^r_smn, antisymmetric in m and n.
+
+        R^r_smn = d_m Gamma^r_ns - d_n Gamma^r_ms
+                  + Gamma^r_ml Gamma^l_ns - Gamma^r_nl Gamma^l_ms
+        """
+        if self.rm is not None:
+            return self.rm
+        gamma = self.christoffel()
+        if self.dgamma is None:
+            self.dgamma = self.differentiate(gamma)
+        dgamma = self.dgamma
+        one = constant(1)
+        n = self.n
+        indices = []
+        tasks = []
+        for r in range(n):
+            for s in range(n):
+                for m in range(n):
+                    for q in range(m + 1, n):
+                        terms = [(1,dgamma[m,r,q,s],one),(-1,dgamma[q,r,m,s],one)]
+                        for l in range(n):
+                            terms += [(1,gamma[r,m,l],gamma[l,q,s]),(-1,gamma[r,q,l],gamma[l,m,s])]
+                        terms = [term for term in terms if not term[1].iszero() and not term[2].iszero()]
+                        if terms:
+                            indices += [(r,s,m,q)]
+                            tasks += [(terms,)]
+        self.rm = self.collect(Tensor(n, 4, [(2,3,-1)]), indices, tasks)
+        return self.rm
+    
+    def ricci(self):
+        """Return R_sn = R^r_srn, symmetric in s and n."""
+        if self.rc is not None:
+            return self.rc
+        rm = self.riemann()
+        self.rc = Tensor(self.n, 2, [(0,1,1)])
+        for s in range(self.n):
+            for q in range(s, self.n):
+                value = Frac()
+                for r in range(self.n):
+                    if (r,s,r,q) in rm:
+                        value += rm[r,s,r,q]
+                self.rc[s,q] = value
+        return self.rc
 
 
 class Token(object):
@@ -384,95 +1154,52 @@ class Token(object):
         return self.__str__()
 
 
+# operator tokens carry nothing but their type, so each is built once
+OPERATOR_TOKENS = {'+': Token(PLUS, '+'),
+                   '-': Token(MINUS, '-'),
+                   '*': Token(MUL, '*'),
+                   '/': Token(DIV, '/'),
+                   '^': Token(POW, '^'),
+                   '(': Token(LPAREN, '('),
+                   ')': Token(RPAREN, ')'),
+                   '&': Token(DERIV, '&')}
+EOF_TOKEN = Token(EOF, None)
+# one alternative per kind of token, after any whitespace; a variable is a
+# single letter
+TOKEN_REGEX = re.compile(r'''\s*(?:
+    (?P<int>\d+)
+  | (?P<var>[^\W\d_])
+  | (?P<op>[-+*/^()&])
+  | (?P<error>\S))''', re.VERBOSE)
+
+def tokenize(text):
+    """Yield a (token, offset) pair for every token of `text`, in one pass."""
+    for match in TOKEN_REGEX.finditer(text):
+        kind = match.lastgroup
+        value = match[kind]
+        if kind == 'op':
+            token = OPERATOR_TOKENS[value]
+        elif kind == 'int':
+            token = Token(FRAC, Frac(Poly({monomial():int(value)}),Poly({monomial():1})))
+        elif kind == 'var':
+            token = Token(FRAC, Frac(Poly({monomial((value,),(1,)):1}),Poly({monomial():1})))
+        else:
+            raise Exception(f'Invalid character {value} at offset {match.start(kind)}')
+        yield token, match.start(kind)
+
+
 class Lexer(object):
     def __init__(self, text):
         # client string input, e.g. "3 * 5", "12 / 3 * 4", etc
         self.text = text
-        # self.pos is an index into self.text
+        self.tokens = tokenize(text)
+        # self.pos is the offset of the last token returned
         self.pos = 0
-        self.current_char = self.text[self.pos]
-
-    def error(self):
-        raise Exception('Invalid character')
-
-    def advance(self):
-        """Advance the `pos` pointer and set the `current_char` variable."""
-        self.pos += 1
-        if self.pos > len(self.text) - 1:
-            self.current_char = None  # Indicates end of input
-        else:
-            self.current_char = self.text[self.pos]
-
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
-
-    def integer(self):
-        """Return a (multidigit) integer consumed from the input."""
-        result = ''
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-        
-        
-        return Frac(Poly({((),()):int(result)}),Poly({((),()):1}))
-    
-    def variable(self):
-        num = Poly({((self.current_char,),(1,)):1})
-        den = Poly({((),()):1})
-        self.advance()
-        return Frac(num,den)
 
     def get_next_token(self):
-        """Lexical analyzer (also known as scanner or tokenizer)
-
-        This method is responsible for breaking a sentence
-        apart into tokens. One token at a time.
-        """
-        while self.current_char is not None:
-
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
-
-            if self.current_char.isdigit():
-                return Token(FRAC, self.integer())
-
-            if self.current_char == '+':
-                self.advance()
-                return Token(PLUS, '+')
-
-            if self.current_char == '-':
-                self.advance()
-                return Token(MINUS, '-')
-
-            if self.current_char == '*':
-                self.advance()
-                return Token(MUL, '*')
-            
-            if self.current_char == '/':
-                self.advance()
-                return Token(DIV, '/')
-            
-            if self.current_char == '(':
-                self.advance()
-                return Token(LPAREN, '(')
-
-            if self.current_char == ')':
-                self.advance()
-                return Token(RPAREN, ')')
-            
-            if self.current_char.isalpha():
-                return Token(FRAC, self.variable())
-            
-            if self.current_char == '&':
-                self.advance()
-                return Token(DERIV, '&')
-            
-
-            self.error()
-
-        return Token(EOF, None)
+        """Return the next token of the input, EOF once it is used up."""
+        token, self.pos = next(self.tokens, (EOF_TOKEN, len(self.text)))
+        return token
 
 
 class Interpreter(object):
@@ -482,7 +1209,7 @@ class Interpreter(object):
         self.current_token = self.lexer.get_next_token()
 
     def error(self):
-        raise Exception('Invalid syntax')
+        raise Exception(f'Invalid syntax at offset {self.lexer.pos}')
 
     def eat(self, token_type):
         # compare the current token type with the passed token
@@ -509,25 +1236,56 @@ class Interpreter(object):
             return result
         elif token.type == DERIV:
             self.eat(DERIV)
-            result = self.factor().derive()
+            result = self.power().derive()
             return result
         else:
             self.error()
 
+    def power(self):
+        """power : factor (POW exponent)?"""
+        result = self.factor()
+        if self.current_token.type == POW:
+            self.eat(POW)
+            result = result ** self.exponent()
+        return result
+    
+    def exponent(self):
+        """exponent : (MINUS)? FRAC (POW exponent)?
+
+        The FRAC must be an integer; ^ is right associative, so 2^3^2 is
+        2^9.
+        """
+        sign = 1
+        if self.current_token.type == MINUS:
+            self.eat(MINUS)
+            sign = -1
+        token = self.current_token
+        self.eat(FRAC)
+        if token.value.num.mainvar() >= 0 or token.value.den.terms != {0:1}:
+            self.error()
+        result = sign * token.value.num.terms.get(0, 0)
+        if self.current_token.type == POW:
+            self.eat(POW)
+            top = self.exponent()
+            if top < 0:
+                self.error()
+            result = result ** top
+        return result
+
 
     def term(self):
-        """term : factor ((MUL) factor)*"""
-        result = self.factor()
+        """term : power ((MUL | DIV) power)*"""
+        result = self.power()
 
         while self.current_token.type in (MUL,DIV):
             token = self.current_token
             if token.type == MUL:
                 self.eat(MUL)
-                result = result * self.factor()
+                result = result * self.power()
                 
             if token.type == DIV:
                 self.eat(DIV)
-                result = result / self.factor()
+                result = result / self.power()
 
         return result
 
@@ -546,7 +1304,55 @@ class Interpreter(object):
         return result
 
 
+def terms(value):
+    """Return the number of terms in a Poly, a Frac or a tuple of them."""
+    if isinstance(value,Poly):
+        return len(value.terms)
+    if isinstance(value,Frac):
+        return len(value.num.terms) + len(value.den.terms)
+    if isinstance(value,tuple):
+        return sum(terms(item) for item in value)
+    return 0
+
+def terms_in(args):
+    return sum(terms(arg) for arg in args)
+
+# operations reported by the stats command, with terms in and out; the
+# in-place ones report their target, and the Metric stages the number of
+# components they store
+for name in ('__add__', '__sub__', '__mul__', '__pow__', 'divide', 'gcd', 'derive'):
+    PROFILE.instrument(Poly, name, terms_in, lambda args, result: terms(result))
+for name in ('accumulate', 'addmul'):
+    PROFILE.instrument(Poly, name, terms_in, lambda args, result: terms(args[0]))
+for name in ('__add__', '__sub__', '__mul__', '__truediv__', '__pow__', 'derive'):
+    PROFILE.instrument(Frac, name, terms_in, lambda args, result: terms(result))
+PROFILE.instrument(Frac, 'annihilate', terms_in, lambda args, result: terms(args[0]))
+for name in ('christoffel', 'riemann', 'ricci'):
+    PROFILE.instrument(Metric, name, None, lambda args, result: len(result))
+PROFILE.instrument(Lexer, 'get_next_token')
+PROFILE.instrument(Interpreter, 'expr')
+
+def read_metric(text, workers = None):
+    """Build a Metric from 'x, y | g11, g12; g21, g22'."""
+    coords,sep,body = text.partition('|')
+    coords = [char.strip() for char in coords.split(',')]
+    if not sep or not all(len(char) == 1 and char.isalpha() for char in coords):
+        raise Exception('usage: metric x, y | g11, g12; g21, g22')
+    rows = [[Interpreter(Lexer(entry)).expr() for entry in row.split(',')] for row in body.split(';')]
+    return Metric(coords, rows, workers)
+
+def components(metric, name):
+    """Return the (label, value) of every stored component of a tensor."""
+    labels = {'inverse': (metric.inverse, 'g^{}{}'),
+              'christoffel': (metric.christoffel, 'G^{}_{}{}'),
+              'riemann': (metric.riemann, 'R^{}_{}{}{}'),
+              'ricci': (metric.ricci, 'R_{}{}')}
+    table,label = labels[name]
+    return [(label.format(*[metric.coords[i] for i in index]),value)
+            for index,value in sorted(table().items())]
+
 def main():
+    metric = None
     while True:
         try:
             # To run under Python3 replace 'raw_input' call
@@ -556,6 +1362,29 @@ def main():
             break
         if not text:
             continue
+        # 'stats', optionally followed by on, off, reset or json
+        words = text.split()
+        if words[0] == 'stats' and len(words) <= 2:
+            output = PROFILE.command(words[1] if len(words) == 2 else None)
+            if output is not None:
+                print(output)
+            continue
+        # 'metric x, y | ...' sets the metric, 'det' prints its determinant
+        # and 'inverse', 'christoffel', 'riemann' or 'ricci' the nonzero
+        # components of a tensor
+        if words[0] == 'metric':
+            metric = read_metric(text[len('metric'):])
+            continue
+        if words[0] in ('det', 'inverse', 'christoffel', 'riemann', 'ricci') and len(words) == 1:
+            if metric is None:
+                raise Exception('no metric set')
+            if words[0] == 'det':
+                print(metric.det())
+                continue
+            for label,value in components(metric, words[0]):
+                print(f'{label} =')
+                print(value)
+            continue
         lexer = Lexer(text)
         interpreter = Interpreter(lexer)
         result = interpreter.expr()
@@ -0,0 +1,119 @@
+"""Instrumentation for the passes of spi.py and interpreter.py.
+
+A module registers the functions worth watching with PROFILE.instrument.
+While PROFILE is enabled they are replaced by wrappers that count calls,
+accumulate wall time and add up the sizes going in and out, for example
+the arguments of a node or the terms of a polynomial. Disabled, the
+original functions are back in place and cost nothing extra.
+"""
+import json
+import time
+
+
+class Pass(object):
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.size_in = 0
+        self.size_out = 0
+        # calls currently running, so that recursion is timed once
+        self.depth = 0
+
+    def record(self):
+        return {'calls': self.calls, 'time': self.time, 'in': self.size_in, 'out': self.size_out}
+
+
+class Profile(object):
+    def __init__(self):
+        self.enabled = False
+        # name -> Pass
+        self.passes = {}
+        # (owner, attribute, function, wrapper) of every instrumented function
+        self.hooks = []
+
+    def instrument(self, owner, attribute, size_in = None, size_out = None):
+        """Watch owner.attribute, a function or method, while enabled.
+
+        `size_in(args)` is measured before a call and `size_out(args,
+        result)` after it, so that in-place operations can report the size
+        of their target both ways.
+        """
+        function = owner.__dict__[attribute]
+        name = f'{owner.__name__}.{attribute}'
+        profile = self
+
+        def wrapper(*args, **kwargs):
+            entry = profile.passes.get(name)
+            if entry is None:
+                entry = profile.passes[name] = Pass()
+            entry.calls += 1
+            if size_in is not None:
+                entry.size_in += size_in(args)
+            entry.depth += 1
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                entry.depth -= 1
+                if not entry.depth:
+                    entry.time += time.perf_counter() - start
+            if size_out is not None:
+                entry.size_out += size_out(args, result)
+            return result
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        self.hooks += [(owner, attribute, function, wrapper)]
+        if self.enabled:
+            setattr(owner, attribute, wrapper)
+
+    def enable(self):
+        if not self.enabled:
+            for owner,attribute,function,wrapper in self.hooks:
+                setattr(owner, attribute, wrapper)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            for owner,attribute,function,wrapper in self.hooks:
+                setattr(owner, attribute, function)
+            self.enabled = False
+
+    def reset(self):
+        self.passes = {}
+
+    def dump(self):
+        """Return the records of every pass as a JSON document."""
+        return json.dumps({name: entry.record() for name,entry in sorted(self.passes.items())},
+                          indent = 1)
+
+    def __str__(self):
+        lines = [f'{"pass":<32}{"calls":>10}{"seconds":>12}{"in":>12}{"out":>12}']
+        for name,entry in sorted(self.passes.items(), key = lambda item: -item[1].time):
+            lines += [f'{name:<32}{entry.calls:>10}{entry.time:>12.6f}{entry.size_in:>12}{entry.size_out:>12}']
+        if not self.enabled:
+            lines += ['(profiling is off)']
+        return '\n'.join(lines)
+
+    def command(self, arg = None):
+        """Carry out a stats command; returns the text to print, if any.
+
+        No argument prints the table; 'on', 'off' and 'reset' switch or
+        clear the instrumentation and 'json' returns the JSON dump.
+        """
+        if arg is None:
+            return str(self)
+        if arg == 'on':
+            self.enable()
+        elif arg == 'off':
+            self.disable()
+        elif arg == 'reset':
+            self.reset()
+        elif arg == 'json':
+            return self.dump()
+        else:
+            raise Exception(f'unknown stats command {arg}')
+        return None
+
+
+PROFILE = Profile()
@@ -0,0 +1,259 @@
+"""Serve spi.py sessions over line-delimited JSON-RPC 2.0.
+
+Every connection gets an Interpreter with scopes of its own, so clients
+cannot see or overwrite each other's variables. A request is one line of JSON, a response is one line back:
+
+    {"jsonrpc": "2.0", "id": 1, "method": "execute", "params": {"text": "y=x*x; show(y)"}}
+    {"jsonrpc": "2.0", "id": 1, "result": {"output": "(x)^(2)\\n", "seconds": 0.0004}}
+
+Methods are 'execute', which runs a batch of statements and returns what
+they printed, and 'metrics', which returns latency figures per method.
+Sessions live in N worker processes (--workers, the CPU count by default)
+and every statement runs there, so the event loop only moves JSON: a slow
+derivation holds up the sessions of its own worker, but not the others.
+Each worker keeps one simplification cache for the sessions it holds.
+
+    $ python server.py --port 7878 --workers 4
+    $ python server.py --unix /tmp/spi.sock
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import spi
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+EXECUTION_ERROR = -32000
+# latencies kept per method for the percentiles
+WINDOW = 1024
+# longest request line accepted, in bytes
+LINE_LIMIT = 1 << 24
+# session id -> Session, in a worker process
+SESSIONS = {}
+# simplification cache shared by the sessions of a worker process
+CACHE = None
+
+
+class RPCError(Exception):
+    def __init__(self, code, message, data = None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.data = data
+
+
+class Latency(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        # the most recent WINDOW latencies
+        self.recent = deque(maxlen = WINDOW)
+
+    def record(self, seconds, failed):
+        self.count += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def report(self):
+        recent = sorted(self.recent)
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(p * len(recent)))] if recent else 0.0
+        return {'count': self.count, 'errors': self.errors,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': percentile(0.5), 'p95': percentile(0.95), 'max': self.max}
+
+
+class Session(object):
+    """The interpreter of one connection, writing into a buffer."""
+    def __init__(self, cache):
+        self.out = io.StringIO()
+        self.interpreter = spi.Interpreter(out = self.out, isolated = True)
+        self.interpreter.cache = cache
+
+    def output(self):
+        text = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return text
+
+
+def start_worker(cache_size):
+    global CACHE
+    CACHE = spi.SimplifyCache(cache_size)
+
+def execute_remote(session, text):
+    """Worker task: run statements in a session; returns (output, error)."""
+    entry = SESSIONS.get(session)
+    if entry is None:
+        entry = SESSIONS[session] = Session(CACHE)
+    try:
+        entry.interpreter.execute(text)
+    except Exception as e:
+        return entry.output(), str(e)
+    return entry.output(), None
+
+def close_remote(session):
+    """Worker task: forget a session."""
+    SESSIONS.pop(session, None)
+
+
+class Server(object):
+    def __init__(self, workers = None, cache_size = 4096):
+        # one single-process pool per worker, so a session always runs
+        # in the process that holds it
+        self.workers = [ProcessPoolExecutor(1, initializer = start_worker, initargs = (cache_size,))
+                        for i in range(workers or os.cpu_count() or 1)]
+        # sessions held by each worker
+        self.load = [0] * len(self.workers)
+        # method name -> Latency
+        self.latency = {}
+        self.sessions = 0
+        self.next_session = 0
+        self.methods = {'execute': self.execute, 'metrics': self.metrics}
+
+    def open(self):
+        """Return (session id, worker index) for a new connection."""
+        self.next_session += 1
+        worker = self.load.index(min(self.load))
+        self.load[worker] += 1
+        self.sessions += 1
+        return self.next_session,worker
+
+    def close(self, session):
+        id,worker = session
+        self.load[worker] -= 1
+        self.sessions -= 1
+        if self.workers:
+            self.workers[worker].submit(close_remote, id)
+
+    async def execute(self, session, params):
+        text = params.get('text') if isinstance(params,dict) else None
+        if not isinstance(text,str):
+            raise RPCError(INVALID_PARAMS, "execute takes {'text': statements}")
+        start = time.perf_counter()
+        id,worker = session
+        try:
+            output,error = await asyncio.get_running_loop().run_in_executor(
+                self.workers[worker], execute_remote, id, text)
+        except Exception as e:
+            # the worker process died, taking its sessions with it
+            raise RPCError(EXECUTION_ERROR, f'session lost: {e}')
+        if error is not None:
+            raise RPCError(EXECUTION_ERROR, error, {'output': output})
+        return {'output': output, 'seconds': time.perf_counter() - start}
+
+    async def metrics(self, session, params):
+        return {'sessions': self.sessions, 'workers': list(self.load),
+                'methods': {name: entry.report() for name,entry in sorted(self.latency.items())}}
+
+    async def call(self, session, request):
+        """Answer one request object; returns None for a notification."""
+        if not isinstance(request,dict) or request.get('jsonrpc') != '2.0' or \
+           not isinstance(request.get('method'),str):
+            return error_response(None, RPCError(INVALID_REQUEST, 'invalid request'))
+        name = request['method']
+        start = time.perf_counter()
+        failed = True
+        try:
+            method = self.methods.get(name)
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, f'no method {name}')
+            result = await method(session, request.get('params', {}))
+            response = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+            failed = False
+        except RPCError as e:
+            response = error_response(request.get('id'), e)
+        if name in self.methods:
+            self.latency.setdefault(name, Latency()).record(time.perf_counter() - start, failed)
+        return response if 'id' in request else None
+
+    async def handle(self, reader, writer):
+        """Serve one connection: requests are answered in order."""
+        session = self.open()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # over LINE_LIMIT; the rest of the stream is unusable
+                    writer.write(encode_response(error_response(None, RPCError(INVALID_REQUEST, 'request too long'))))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = error_response(None, RPCError(PARSE_ERROR, 'parse error'))
+                else:
+                    if isinstance(request,list) and request:
+                        response = [response for response in
+                                    [await self.call(session, item) for item in request]
+                                    if response is not None] or None
+                    else:
+                        response = await self.call(session, request)
+                if response is not None:
+                    writer.write(encode_response(response))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.close(session)
+            writer.close()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+        self.workers = []
+
+
+def error_response(id, e):
+    error = {'code': e.code, 'message': str(e)}
+    if e.data is not None:
+        error['data'] = e.data
+    return {'jsonrpc': '2.0', 'id': id, 'error': error}
+
+def encode_response(response):
+    return json.dumps(response).encode() + b'\n'
+
+async def serve(server, host = '127.0.0.1', port = 7878, path = None):
+    if path is not None:
+        listener = await asyncio.start_unix_server(server.handle, path = path, limit = LINE_LIMIT)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port, limit = LINE_LIMIT)
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    argparser = argparse.ArgumentParser(description = 'Serve calculus sessions over JSON-RPC.')
+    argparser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on')
+    argparser.add_argument('--port', type = int, default = 7878, help = 'TCP port to listen on')
+    argparser.add_argument('--unix', help = 'listen on this Unix socket instead of TCP')
+    argparser.add_argument('-j', '--workers', type = int, default = None,
+                           help = 'run sessions on this many processes (default: one per CPU)')
+    args = argparser.parse_args()
+
+    server = Server(args.workers)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
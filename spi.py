@@ -1,9 +1,29 @@
-(log, PART, VAR, DIF,INT, ADD, SUB, MUL, DIV, LPAREN, RPAREN, ID, ASSIGN,
- SEMI, EOF, LBRACK, RBRACK, show, UNDERSCORE) = (
-    'log','PART', 'VAR','DIF','INT', 'ADD', 'SUB', 'MUL', 'DIV', '(', ')', 'ID', 'ASSIGN',
-    'SEMI', 'EOF', '{', '}','show','_')
+import argparse
+import hashlib
+import keyword
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import PROFILE
+
+(log, PART, VAR, DIF,INT, ADD, SUB, MUL, DIV, POW, LPAREN, RPAREN, ID, ASSIGN,
+ SEMI, EOF, LBRACK, RBRACK, show, UNDERSCORE, cache, lambdify, COMMA, grad,
+ save, load, STRING, stats, eval_, REAL, checkpoint, rollback, fork) = (
+    'log','PART', 'VAR','DIF','INT', 'ADD', 'SUB', 'MUL', 'DIV', 'POW', '(', ')', 'ID', 'ASSIGN',
+    'SEMI', 'EOF', '{', '}','show','_','cache','lambdify', ',', 'grad',
+    'save', 'load', 'STRING', 'stats', 'eval', 'REAL', 'checkpoint', 'rollback', 'fork')
      
 class Token(object):
+    __slots__ = ('type', 'value')
+    
     def __init__(self, type, value):
         self.type = type
         self.value = value
@@ -21,8 +41,74 @@ class Token(object):
     def __eq__(self,opp):
         return opp.type == self.type and opp.value == self.value
 
+# bytes of script read (and of output buffered) at a time in batch mode
+CHUNK_SIZE = 1 << 16
+
 RESERVED_KEYWORDS = {show: Token(show,show),
-                     log: Token(log,log)}
+                     log: Token(log,log),
+                     cache: Token(cache,cache),
+                     lambdify: Token(lambdify,lambdify),
+                     grad: Token(grad,grad),
+                     save: Token(save,save),
+                     load: Token(load,load),
+                     stats: Token(stats,stats),
+                     eval_: Token(eval_,eval_),
+                     checkpoint: Token(checkpoint,checkpoint),
+                     rollback: Token(rollback,rollback),
+                     fork: Token(fork,fork)}
+# operator tokens carry nothing but their type, so each is built once
+OPERATOR_TOKENS = {'=': Token(ASSIGN,'='),
+                   ';': Token(SEMI,';'),
+                   ',': Token(COMMA,','),
+                   '+': Token(ADD,'+'),
+                   '-': Token(SUB,'-'),
+                   '*': Token(MUL,'*'),
+                   '/': Token(DIV,'/'),
+                   '^': Token(POW,'^'),
+                   '(': Token(LPAREN,'('),
+                   ')': Token(RPAREN,')'),
+                   '{': Token(LBRACK,'{'),
+                   '}': Token(RBRACK,'}'),
+                   '&': Token(DIF,'&'),
+                   '$_': Token(PART,'$')}
+EOF_TOKEN = Token(EOF,None)
+# one alternative per kind of token, after any whitespace
+TOKEN_REGEX = re.compile(r'''\s*(?:
+    (?P<id>[^\W\d_][^\W_]*)
+  | (?P<real>\d+\.\d*|\.\d+)
+  | (?P<int>\d+)
+  | (?P<op>\$_|[=;,+\-*/^(){}&])
+  | (?P<str>"[^"\n]*")
+  | (?P<error>\S))''', re.VERBOSE)
+
+def tokenize(text):
+    """Yield a (token, offset) pair for every token of `text`, in one pass.
+
+    Tokens are shared between equal spellings, so an identifier or number
+    that recurs in a buffer is only built once.
+    """
+    known = dict(OPERATOR_TOKENS)
+    known.update(RESERVED_KEYWORDS)
+    for match in TOKEN_REGEX.finditer(text):
+        kind = match.lastgroup
+        value = match[kind]
+        token = known.get(value)
+        if token is None:
+            if kind == 'id':
+                token = Token(ID,value)
+            elif kind == 'int':
+                token = Token(INT,int(value))
+            elif kind == 'real':
+                token = Token(REAL,float(value))
+            elif kind == 'str':
+                token = Token(STRING,value[1:-1])
+            else:
+                raise Exception(f'Invalid character {value} at offset {match.start(kind)}')
+            known[value] = token
+        yield token, match.start(kind)
+
+# variation tokens, one per name
+VAR_TOKENS = {}
 WEIGHT_KEYS = {ADD: '*', 
                MUL: '^'}
 
@@ -30,127 +116,55 @@ class Lexer(object):
     def __init__(self, text):
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
         self.text = text
-        # self.pos is an index into self.text
+        self.tokens = tokenize(text)
+        # self.pos is the offset of the last token returned
         self.pos = 0
-        self.current_char = self.text[self.pos]
 
-    def error(self):
-        raise Exception(f'Invalid character {self.current_char}')
-
-    def advance(self):
-        """Advance the `pos` pointer and set the `current_char` variable."""
-        self.pos += 1
-        if self.pos > len(self.text) - 1:
-            self.current_char = None  # Indicates end of input
-        else:
-            self.current_char = self.text[self.pos]
-
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
-
-    def integer(self):
-        """Return a (multidigit) integer consumed from the input."""
-        result = ''
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-        return int(result)
-    
-    def peek(self):
-        peek_pos = self.pos + 1
-        if peek_pos > len(self.text) - 1:
-            return None
-        else:
-            return self.text[peek_pos]
-
-    def _id(self):
-        """Handle identifiers and reserved keywords"""
-        result = ''
-        while self.current_char is not None and (self.current_char.isalnum()):
-            result += self.current_char
-            self.advance()
-        
-        token = RESERVED_KEYWORDS.get(result, Token(ID, result))
-        return token
-    
     def get_next_token(self):
-        """Lexical analyzer (also known as scanner or tokenizer)
-
-        This method is responsible for breaking a sentence
-        apart into tokens. One token at a time.
-        """
-        while self.current_char is not None:
-
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
-
-            if self.current_char.isalpha():
-                return self._id()
-
-            if self.current_char.isdigit():
-                return Token(INT, self.integer())
-
-            if self.current_char == '=':
-                self.advance()
-                return Token(ASSIGN, '=')
-
-            if self.current_char == ';':
-                self.advance()
-                return Token(SEMI, ';')
-
-            if self.current_char == '+':
-                self.advance()
-                return Token(ADD, '+')
-
-            if self.current_char == '-':
-                self.advance()
-                return Token(SUB, '-')
-
-            if self.current_char == '*':
-                self.advance()
-                return Token(MUL, '*')
-
-            if self.current_char == '/':
-                self.advance()
-                return Token(DIV, '/')
-
-            if self.current_char == '(':
-                self.advance()
-                return Token(LPAREN, '(')
-
-            if self.current_char == ')':
-                self.advance()
-                return Token(RPAREN, ')')
-            
-            if self.current_char == '{':
-                self.advance()
-                return Token(LBRACK, '{')
-            
-            if self.current_char == '}':
-                self.advance()
-                return Token(RBRACK, '}')
-            
-            if self.current_char == '&':
-                self.advance()
-                return Token(DIF,'&')
-            
-            if self.current_char == '$' and self.peek() == '_':
-                self.advance()
-                self.advance()
-                return Token(PART,'$')
-
-            self.error()
-
-        return Token(EOF, None)
+        """Return the next token of the input, EOF once it is used up."""
+        token, self.pos = next(self.tokens, (EOF_TOKEN, len(self.text)))
+        return token
     
     def reset(self):
+        self.tokens = tokenize(self.text)
         self.pos = 0
-        self.current_char = self.text[self.pos]
 
 class AST(object):
-    pass
+    # expression nodes are many and small, so they have no __dict__:
+    # _hash is the structural hash, set once the node is interned in a
+    # NodeTable, _order its sort key among the args of a sum or product
+    # (see NodeTable.order) and _size its number of operator nodes, also
+    # set then; _free the names of the free identifiers, cached on
+    # interned nodes
+    __slots__ = ('__weakref__', '_hash', '_order', '_size', '_free')
+    
+    def __init__(self):
+        self._hash = None
+        self._order = None
+        self._size = None
+        self._free = None
+        
+    @property
+    def op(self):
+        return self.token
+
+    def key(self):
+        return (type(self), id(self))
+
+    def __hash__(self):
+        if self._hash is None:
+            return hash(self.key())
+        return self._hash
+
+    def __eq__(self,opp):
+        if self is opp:
+            return True
+        if not isinstance(opp,AST):
+            return False
+        if self._hash is not None and opp._hash is not None:
+            # interned nodes are unique per structure
+            return False
+        return self.key() == opp.key()
 
 class NoOp(AST):
     pass
@@ -160,107 +174,888 @@ class Compound(AST):
         self.children = []
         
 class Num(AST):
+    __slots__ = ('token', 'weight')
+    
     def __init__(self,token,weight = 1):
+        AST.__init__(self)
         self.token = token
         self.weight = weight
         
-    def __eq__(self,opp):
-        return self.token == opp.token
+    def key(self):
+        return (Num, self.token.value, self.weight)
     
     def copy(self):
         return Num(self.token,self.weight)
         
 class Id(AST):
+    __slots__ = ('token', 'weight')
+    
     def __init__(self, token, weight = 1):
+        AST.__init__(self)
         self.token = token
         self.weight = weight
         
-    def __eq__(self,opp):
-        return self.token == opp.token
+    def key(self):
+        return (Id, self.token.value, self.weight)
     
     def copy(self):
         return Id(self.token,self.weight)
         
 class Var(AST):
+    __slots__ = ('token', 'order', 'weight')
+    
     def __init__(self, token, order = 1, weight = 1):
-        self.token = Token(VAR,token.value)
+        AST.__init__(self)
+        if token.type != VAR:
+            token = VAR_TOKENS.get(token.value) or VAR_TOKENS.setdefault(token.value, Token(VAR,token.value))
+        self.token = token
         self.order = order
         self.weight = weight
     
-    def __eq__(self,opp):
-        return self.token == opp.token
+    def key(self):
+        return (Var, self.token.value, self.order, self.weight)
     
     def copy(self):
         return Var(self.token,self.order,self.weight)
 
 class AsOp(AST):
-    def __init__(self, token, weight = 1):
-        self.token = self.op = token
+    __slots__ = ('token', 'args', 'weight', 'shared')
+    
+    def __init__(self, token, weight = 1, shared = False):
+        AST.__init__(self)
+        self.token = token
         self.args = []
         self.weight = weight
+        # shared products are kept apart from the products they occur in
+        self.shared = shared
         
-    def __eq__(self,opp):
-        if opp.token != self.token:
-            return False
-        for arg in self.args:
-            if arg not in opp.args:
-                return False
-        for arg in opp.args:
-            if arg not in self.args:
-                return False
-        return True
+    def key(self):
+        # args commute, so compare them as a multiset
+        return (AsOp, self.token.type, self.weight, self.shared,
+                frozenset(Counter(self.args).items()))
     
     def copy(self):
-        copy = AsOp(self.token,self.weight)
+        copy = AsOp(self.token,self.weight,self.shared)
         copy.args += self.args
         return copy
     
 class UnOp(AST):
+    __slots__ = ('token', 'arg', 'weight')
+    
     def __init__(self, token, arg, weight = 1):
-        self.token = self.op = token
+        AST.__init__(self)
+        self.token = token
         self.arg = arg
         self.weight = weight
         
-    def __eq__(self,opp):
-        return self.token == opp.token and self.arg == opp.arg
+    def key(self):
+        return (UnOp, self.token.type, self.arg, self.weight)
     
     def copy(self):
         return UnOp(self.token,self.arg,self.weight)
     
 class BinOp(AST):
+    __slots__ = ('token', 'left', 'right', 'weight')
+    
     def __init__(self, left, token, right, weight = 1):
-        self.token = self.op = token
+        AST.__init__(self)
+        self.token = token
         self.left = left
         self.right = right
+        self.weight = weight
         
-    def __eq__(self,opp):
-        return self.token == opp.token and self.arg == opp.arg
+    def key(self):
+        return (BinOp, self.token.type, self.left, self.right, self.weight)
     
     def copy(self):
-        return BinOp(self.left,self.token,self.right)
+        return BinOp(self.left,self.token,self.right,self.weight)
     
 class Assign(AST):
     def __init__(self, left, token, right):
         self.left = left
-        self.token = self.op = token
+        self.token = token
         self.right = right
         
 class Show(AST):
     def __init__(self,token,args):
-        self.token = self.op = token
+        self.token = token
+        self.args = args
+        
+class Lambdify(AST):
+    def __init__(self,token,args):
+        self.token = token
         self.args = args
+        
+class Grad(AST):
+    def __init__(self,token,funcs,args):
+        self.token = token
+        self.funcs = funcs
+        self.args = args
+        
+class Cache(AST):
+    def __init__(self,token,size = None):
+        self.token = token
+        self.size = size
+        
+class Stats(AST):
+    def __init__(self,token,command = None):
+        self.token = token
+        self.command = command
+        
+class Eval(AST):
+    def __init__(self,token,expr,values):
+        self.token = token
+        self.expr = expr
+        # name -> number
+        self.values = values
+        
+class Save(AST):
+    def __init__(self,token,path):
+        self.token = token
+        self.path = path
+        
+class Load(AST):
+    def __init__(self,token,path):
+        self.token = token
+        self.path = path
+        
+class Checkpoint(AST):
+    def __init__(self,token,name = None):
+        self.token = token
+        self.name = name
+        
+class Rollback(AST):
+    def __init__(self,token,name = None):
+        self.token = token
+        self.name = name
+        
+class Fork(AST):
+    def __init__(self,token,name):
+        self.token = token
+        self.name = name
+    
+class NodeTable(object):
+    """Hash-consing table for expression nodes.
+
+    Structurally identical subtrees are mapped onto one shared object that
+    carries its structural hash, so equality of interned nodes is identity
+    and nodes can be used as dict keys. Interned nodes must never be
+    mutated: build a copy and intern that instead.
+
+    The args of a sum or product are a multiset, so the shared node keeps
+    them sorted by NodeTable.order; that way an expression prints the same
+    whichever ordering of it was interned first.
+    """
+    def __init__(self):
+        self.nodes = weakref.WeakValueDictionary()
+        
+    def __len__(self):
+        return len(self.nodes)
+        
+    def intern(self, node):
+        if node._hash is not None:
+            return node
+        
+        # subtrees are interned children first from an explicit stack;
+        # id(subtree) -> its shared copy
+        done = {}
+        stack = [node]
+        while stack:
+            top = stack[-1]
+            pending = [child for child in children(top)
+                       if child._hash is None and id(child) not in done]
+            if pending:
+                stack += pending
+                continue
+            
+            stack.pop()
+            if id(top) in done:
+                continue
+            if isinstance(top,AsOp):
+                top.args = [done.get(id(arg), arg) for arg in top.args]
+            elif isinstance(top,UnOp):
+                top.arg = done.get(id(top.arg), top.arg)
+            elif isinstance(top,BinOp):
+                top.left = done.get(id(top.left), top.left)
+                top.right = done.get(id(top.right), top.right)
+            
+            key = top.key()
+            shared = self.nodes.get(key)
+            if shared is None:
+                if isinstance(top,AsOp):
+                    top.args.sort(key = ORDER)
+                top._order = self.order(top)
+                if isinstance(top,(AsOp,UnOp,BinOp)):
+                    top._size = 1 + sum(child._size for child in children(top))
+                else:
+                    top._size = 0
+                top._hash = hash(key)
+                self.nodes[key] = shared = top
+            done[id(top)] = shared
+            
+        return done[id(node)]
+    
+    def order(self, node):
+        """Return the sort key of a node whose children are interned.
+
+        Numbers come first, then identifiers and variations by name, then
+        operators by a digest of their structure; the digest is the last
+        item of every key. Unlike _hash, the key is the same in every
+        process.
+        """
+        if isinstance(node,Num):
+            key = (0, node.token.value, node.weight)
+        elif isinstance(node,Id):
+            key = (1, node.token.value, node.weight)
+        elif isinstance(node,Var):
+            key = (2, node.token.value, node.order, node.weight)
+        else:
+            header = (type(node), node.token.type, node.weight, getattr(node, 'shared', False))
+            digest = HEADERS.get(header)
+            if digest is None:
+                digest = HEADERS[header] = stable(repr(header[1:]) + header[0].__name__)
+            for child in children(node):
+                digest = ((digest * DIGEST_PRIME) ^ child._order[-1]) & DIGEST_MASK
+            return (3, digest)
+        return key + (stable(repr(key)),)
+    
+    def reweight(self, node, weight):
+        """Return the interned copy of `node` carrying `weight`."""
+        node = self.intern(node)
+        if node.weight == weight:
+            return node
+        
+        copy = node.copy()
+        copy.weight = weight
+        return self.intern(copy)
+    
+    def base(self, node):
+        """Return the interned copy of `node` with unit weight."""
+        return self.reweight(node, 1)
+    
+    def free(self, node):
+        """Return the names of the identifiers occurring in `node`."""
+        node = self.intern(node)
+        if node._free is not None:
+            return node._free
+        
+        if isinstance(node,Id):
+            node._free = frozenset([node.token.value])
+        elif isinstance(node,(AsOp,UnOp,BinOp)):
+            # children first, so that no call below recurses further
+            for sub in postorder(node):
+                if sub._free is None:
+                    sub._free = frozenset().union(*[self.free(arg) for arg in children(sub)])
+        else:
+            node._free = frozenset()
+        return node._free
+    
+# sort key of interned nodes
+ORDER = AST._order.__get__
+DIGEST_PRIME = 0x100000001b3
+DIGEST_MASK = (1 << 64) - 1
+
+# (node type, token type, weight, shared) -> digest, for NodeTable.order
+HEADERS = {}
+
+def stable(text):
+    """Return a 64-bit digest of `text` that does not vary between runs."""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size = 8).digest(), 'little')
+
+NODES = NodeTable()
+
+class SimplifyCache(object):
+    """Bounded LRU cache from interned nodes to their simplified form.
+
+    Entries are evicted least recently used first once `size` is exceeded;
+    a size of 0 disables caching.
+    """
+    def __init__(self, size = 4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    def __len__(self):
+        return len(self.entries)
+        
+    def __str__(self):
+        return f'hits={self.hits} misses={self.misses} size={len(self)}/{self.size}'
+        
+    def get(self, node):
+        result = self.entries.get(node)
+        if result is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self.entries.move_to_end(node)
+        return result
     
+    def put(self, node, result):
+        if self.size <= 0:
+            return
+        self.entries[node] = result
+        self.entries.move_to_end(node)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            
+    def resize(self, size):
+        self.size = size
+        while len(self.entries) > max(size, 0):
+            self.entries.popitem(last=False)
+            
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
 def ADDTOKEN():
-    return Token(ADD,'+')
+    return OPERATOR_TOKENS['+']
 
 def MULTOKEN():
-    return Token(MUL,'*')
+    return OPERATOR_TOKENS['*']
 
 def DIFTOKEN():
-    return Token(DIF,'&')
+    return OPERATOR_TOKENS['&']
+
+# NUM(n) for |n| <= SMALL_INT is served from SMALL_NUMS, which also keeps
+# these constants interned for good
+SMALL_INT = 256
+SMALL_NUMS = []
 
 def NUM(n):
-    return Num(Token(INT,n))
+    if type(n) is int and -SMALL_INT <= n <= SMALL_INT:
+        return SMALL_NUMS[n + SMALL_INT]
+    return NODES.intern(Num(Token(INT,n)))
+
+def children(node):
+    if isinstance(node,AsOp):
+        return node.args
+    elif isinstance(node,UnOp):
+        return [node.arg]
+    elif isinstance(node,BinOp):
+        return [node.left,node.right]
+    return []
+
+def postorder(node):
+    """Yield the distinct operator nodes under `node`, children first.
+
+    The walk uses an explicit stack, so it is not limited by the nesting
+    depth of the expression.
+    """
+    seen = set()
+    stack = [(node, False)]
+    while stack:
+        top, expanded = stack.pop()
+        if expanded:
+            yield top
+        elif isinstance(top,(AsOp,UnOp,BinOp)) and id(top) not in seen:
+            seen.add(id(top))
+            stack += [(top, True)]
+            stack += [(child, False) for child in children(top)]
+
+SMALL_NUMS += [NODES.intern(Num(Token(INT,n))) for n in range(-SMALL_INT, SMALL_INT + 1)]
+
+def encode(node):
+    """Flatten an expression into a tuple of records for pickling.
+
+    Shared subtrees are stored once; a record refers to its children by
+    their position and the root is the last record.
+    """
+    records = []
+    index = {}
+    stack = [node]
+    while stack:
+        top = stack[-1]
+        if id(top) in index:
+            stack.pop()
+            continue
+        pending = [child for child in children(top) if id(child) not in index]
+        if pending:
+            stack += pending
+            continue
+        
+        stack.pop()
+        args = tuple(index[id(child)] for child in children(top))
+        if isinstance(top,Num):
+            record = ('N', top.token.value, top.weight)
+        elif isinstance(top,Id):
+            record = ('I', top.token.value, top.weight)
+        elif isinstance(top,Var):
+            record = ('V', top.token.value, top.weight, top.order)
+        elif isinstance(top,AsOp):
+            record = ('S' if top.shared else 'A', top.token.type, top.token.value, top.weight, args)
+        else:
+            record = (type(top).__name__[0], top.token.type, top.token.value, top.weight, args)
+        index[id(top)] = len(records)
+        records += [record]
+        
+    return tuple(records)
+
+def decode(records):
+    """Rebuild the interned expression flattened by encode."""
+    nodes = []
+    for record in records:
+        kind = record[0]
+        if kind == 'N':
+            node = Num(Token(INT,record[1]),record[2])
+        elif kind == 'I':
+            node = Id(Token(ID,record[1]),record[2])
+        elif kind == 'V':
+            node = Var(Token(ID,record[1]),record[3],record[2])
+        else:
+            token = Token(record[1],record[2])
+            args = [nodes[i] for i in record[4]]
+            if kind in 'AS':
+                node = AsOp(token,record[3],kind == 'S')
+                node.args = args
+            elif kind == 'U':
+                node = UnOp(token,args[0],record[3])
+            else:
+                node = BinOp(args[0],token,args[1],record[3])
+        nodes += [NODES.intern(node)]
+        
+    return nodes[-1]
+
+# A workspace snapshot is little-endian binary: the header, the end offset
+# of every symbol within a UTF-8 blob, then the blob, fixed size node
+# records, the child indices of operator nodes, binding records and the
+# free identifiers of every binding. Nodes shared between bindings, or
+# between a definition and its value, are written once.
+SNAPSHOT_MAGIC = b'SPIW'
+SNAPSHOT_VERSION = 1
+# magic, version, symbols, blob bytes, nodes, children, bindings, free ids
+SNAPSHOT_HEADER = struct.Struct('<4sIIIIIII')
+# kind, flags, first child (order for a Var), children, weight, value
+NODE_RECORD = struct.Struct('<BBxxIIqq')
+# name, definition node, value node, first free id, free ids
+BINDING_RECORD = struct.Struct('<IIIII')
+# record flags: weight or value is a symbol holding a big integer, or the
+# node is a shared product
+BIG_WEIGHT, BIG_VALUE, SHARED = 1, 2, 4
+# operator tokens, numbered by their position; the value of operator records
+SNAPSHOT_OPS = (Token(ADD,'+'), Token(MUL,'*'), Token(log,log), Token(DIF,'&'), Token(PART,'$'))
+INT64_MIN, INT64_MAX = -1 << 63, (1 << 63) - 1
+
+def write_snapshot(path, definitions, scope):
+    """Write the bindings of `definitions`, and their values in `scope`."""
+    symbols = {}
+    def symbol(text):
+        if text not in symbols:
+            symbols[text] = len(symbols)
+        return symbols[text]
+    
+    def number(n, flag):
+        if not isinstance(n,int):
+            raise Exception(f'cannot save non-integer {n}')
+        if INT64_MIN <= n <= INT64_MAX:
+            return n, 0
+        return symbol(str(n)), flag
+    
+    ops = {token.type: i for i,token in enumerate(SNAPSHOT_OPS)}
+    records = []
+    kids = []
+    index = {}
+    def write(node):
+        stack = [node]
+        while stack:
+            top = stack[-1]
+            if id(top) in index:
+                stack.pop()
+                continue
+            pending = [child for child in children(top) if id(child) not in index]
+            if pending:
+                stack += pending
+                continue
+            
+            stack.pop()
+            args = [index[id(child)] for child in children(top)]
+            weight, flags = number(top.weight, BIG_WEIGHT)
+            first = len(kids)
+            if isinstance(top,Num):
+                kind = 'N'
+                value, big = number(top.token.value, BIG_VALUE)
+                flags |= big
+            elif isinstance(top,(Id,Var)):
+                kind = type(top).__name__[0]
+                value = symbol(top.token.value)
+                if isinstance(top,Var):
+                    first = top.order
+            else:
+                kind = type(top).__name__[0]
+                value = ops[top.token.type]
+                if isinstance(top,AsOp) and top.shared:
+                    flags |= SHARED
+            kids.extend(args)
+            index[id(top)] = len(records)
+            records.append(NODE_RECORD.pack(ord(kind), flags, first, len(args), weight, value))
+        return index[id(node)]
+    
+    bindings = []
+    frees = []
+    for name in sorted(definitions.names()):
+        definition = definitions[name]
+        free = sorted(NODES.free(definition))
+        bindings += [BINDING_RECORD.pack(symbol(name), write(definition), write(scope[name]),
+                                         len(frees), len(free))]
+        frees += [symbol(text) for text in free]
+        
+    blob = [text.encode() for text in symbols]
+    ends = []
+    for text in blob:
+        ends += [len(text) + (ends[-1] if ends else 0)]
+    blob = b''.join(blob)
+        
+    # written beside `path` and moved over it, so a snapshot still mapped
+    # by an earlier load keeps its own bytes
+    fd,temp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)),
+                               prefix = os.path.basename(path) + '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(ends), len(blob),
+                                              len(records), len(kids), len(bindings), len(frees)))
+            stream.write(struct.pack(f'<{len(ends)}I', *ends))
+            stream.write(blob)
+            stream.write(b''.join(records))
+            stream.write(struct.pack(f'<{len(kids)}I', *kids))
+            stream.write(b''.join(bindings))
+            stream.write(struct.pack(f'<{len(frees)}I', *frees))
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+class Snapshot(object):
+    """A workspace snapshot, memory-mapped for reading.
+
+    Opening one only reads its binding table. Nodes are decoded and
+    interned the first time a binding that reaches them is looked up.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as stream:
+            self.map = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+        (magic, version, nsymbols, nblob, nnodes, nkids,
+         nbindings, nfrees) = SNAPSHOT_HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise Exception(f'{path} is not a workspace snapshot')
+        
+        self.ends = SNAPSHOT_HEADER.size
+        self.blob = self.ends + 4 * nsymbols
+        self.records = self.blob + nblob
+        self.kids = self.records + NODE_RECORD.size * nnodes
+        bindings = self.kids + 4 * nkids
+        frees = bindings + BINDING_RECORD.size * nbindings
+        self.symbols = [None] * nsymbols
+        self.nodes = [None] * nnodes
+        
+        # name -> (definition node, value node, free identifiers)
+        self.bindings = {}
+        for i in range(nbindings):
+            name, definition, value, first, count = BINDING_RECORD.unpack_from(
+                self.map, bindings + BINDING_RECORD.size * i)
+            free = struct.unpack_from(f'<{count}I', self.map, frees + 4 * first)
+            self.bindings[self.symbol(name)] = (definition, value,
+                                                frozenset([self.symbol(j) for j in free]))
+            
+    def symbol(self, i):
+        if self.symbols[i] is None:
+            start = struct.unpack_from('<I', self.map, self.ends + 4 * (i - 1))[0] if i else 0
+            end = struct.unpack_from('<I', self.map, self.ends + 4 * i)[0]
+            self.symbols[i] = self.map[self.blob + start:self.blob + end].decode()
+        return self.symbols[i]
+    
+    def node(self, i):
+        """Return node `i`, decoding the nodes below it that are still encoded."""
+        stack = [i]
+        while stack:
+            top = stack[-1]
+            if self.nodes[top] is not None:
+                stack.pop()
+                continue
+            
+            kind, flags, first, count, weight, value = NODE_RECORD.unpack_from(
+                self.map, self.records + NODE_RECORD.size * top)
+            kind = chr(kind)
+            args = ()
+            if kind in 'AUB':
+                args = struct.unpack_from(f'<{count}I', self.map, self.kids + 4 * first)
+                pending = [arg for arg in args if self.nodes[arg] is None]
+                if pending:
+                    stack += pending
+                    continue
+            
+            stack.pop()
+            args = [self.nodes[arg] for arg in args]
+            if flags & BIG_WEIGHT:
+                weight = int(self.symbol(weight))
+            if kind == 'N':
+                node = Num(Token(INT,int(self.symbol(value)) if flags & BIG_VALUE else value),weight)
+            elif kind == 'I':
+                node = Id(Token(ID,self.symbol(value)),weight)
+            elif kind == 'V':
+                node = Var(Token(ID,self.symbol(value)),first,weight)
+            elif kind == 'A':
+                node = AsOp(SNAPSHOT_OPS[value],weight,bool(flags & SHARED))
+                node.args = args
+            elif kind == 'U':
+                node = UnOp(SNAPSHOT_OPS[value],args[0],weight)
+            else:
+                node = BinOp(args[0],SNAPSHOT_OPS[value],args[1],weight)
+            self.nodes[top] = NODES.intern(node)
+            
+        return self.nodes[i]
+    
+class HAMTNode(object):
+    """An inner node of a PMap: one slot for each set bit of `bitmap`.
+
+    A slot holds either a (key, value) pair or the node below it.
+    """
+    __slots__ = ('bitmap', 'slots')
+    
+    def __init__(self, bitmap, slots):
+        self.bitmap = bitmap
+        self.slots = slots
+        
+class HAMTCollision(object):
+    """The (key, value) pairs of keys whose hashes are equal in all bits."""
+    __slots__ = ('hash', 'slots')
+    
+    def __init__(self, hash, slots):
+        self.hash = hash
+        self.slots = slots
+
+# bits of a hash used to index a node, and the bits in a hash
+HAMT_BITS = 5
+HAMT_MASK = (1 << HAMT_BITS) - 1
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+def hamt_pair(shift, first, first_hash, second, second_hash):
+    """Return a node holding two pairs whose hashes agree below `shift`."""
+    if shift >= HASH_BITS:
+        return HAMTCollision(first_hash, (first, second))
+    i = (first_hash >> shift) & HAMT_MASK
+    j = (second_hash >> shift) & HAMT_MASK
+    if i == j:
+        return HAMTNode(1 << i, (hamt_pair(shift + HAMT_BITS, first, first_hash, second, second_hash),))
+    return HAMTNode((1 << i) | (1 << j), (first, second) if i < j else (second, first))
+
+def hamt_set(node, shift, h, key, value):
+    """Return `node` with key bound to value, and whether the key is new."""
+    if type(node) is HAMTCollision:
+        for i,(k,v) in enumerate(node.slots):
+            if k == key:
+                return HAMTCollision(h, node.slots[:i] + ((key, value),) + node.slots[i + 1:]), False
+        return HAMTCollision(h, node.slots + ((key, value),)), True
+    
+    bit = 1 << ((h >> shift) & HAMT_MASK)
+    i = (node.bitmap & (bit - 1)).bit_count()
+    slots = node.slots
+    if not node.bitmap & bit:
+        return HAMTNode(node.bitmap | bit, slots[:i] + ((key, value),) + slots[i:]), True
+    
+    slot = slots[i]
+    added = False
+    if type(slot) is tuple:
+        if slot[0] == key:
+            if slot[1] is value:
+                return node, False
+            slot = (key, value)
+        else:
+            slot = hamt_pair(shift + HAMT_BITS, slot, hash(slot[0]) & HASH_MASK, (key, value), h)
+            added = True
+    else:
+        slot, added = hamt_set(slot, shift + HAMT_BITS, h, key, value)
+    return HAMTNode(node.bitmap, slots[:i] + (slot,) + slots[i + 1:]), added
+
+def hamt_delete(node, shift, h, key):
+    """Return `node` without key: the node itself if key is not in it, None
+    if nothing is left, or the last pair if it should move up a level."""
+    if type(node) is HAMTCollision:
+        slots = tuple([slot for slot in node.slots if slot[0] != key])
+        if len(slots) == len(node.slots):
+            return node
+        return slots[0] if len(slots) == 1 else HAMTCollision(h, slots)
+    
+    bit = 1 << ((h >> shift) & HAMT_MASK)
+    if not node.bitmap & bit:
+        return node
+    i = (node.bitmap & (bit - 1)).bit_count()
+    slots = node.slots
+    slot = slots[i]
+    if type(slot) is tuple:
+        if slot[0] != key:
+            return node
+        slot = None
+    else:
+        slot = hamt_delete(slot, shift + HAMT_BITS, h, key)
+        if slot is slots[i]:
+            return node
+        
+    if slot is None:
+        slots = slots[:i] + slots[i + 1:]
+        bitmap = node.bitmap & ~bit
+        if not slots:
+            return None
+    else:
+        slots = slots[:i] + (slot,) + slots[i + 1:]
+        bitmap = node.bitmap
+    if shift and len(slots) == 1 and type(slots[0]) is tuple:
+        return slots[0]
+    return HAMTNode(bitmap, slots)
+
+class PMap(object):
+    """A persistent map from hashable keys, as a hash array mapped trie.
+
+    set() and delete() return a new map and leave this one unchanged; the
+    two share every node off the path to the key, so an update costs
+    O(log n) in time and memory and keeping an old version costs nothing.
+    """
+    __slots__ = ('root', 'size')
+    
+    def __init__(self, root = None, size = 0):
+        # HAMTNode, or None when empty
+        self.root = root
+        self.size = size
+        
+    def get(self, key, default = None):
+        node = self.root
+        h = hash(key) & HASH_MASK
+        shift = 0
+        while node is not None:
+            if type(node) is HAMTCollision:
+                for k,v in node.slots:
+                    if k == key:
+                        return v
+                return default
+            bit = 1 << ((h >> shift) & HAMT_MASK)
+            if not node.bitmap & bit:
+                return default
+            node = node.slots[(node.bitmap & (bit - 1)).bit_count()]
+            if type(node) is tuple:
+                return node[1] if node[0] == key else default
+            shift += HAMT_BITS
+        return default
+    
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+    
+    def __len__(self):
+        return self.size
+    
+    def set(self, key, value):
+        h = hash(key) & HASH_MASK
+        if self.root is None:
+            return PMap(HAMTNode(1 << (h & HAMT_MASK), ((key, value),)), 1)
+        root, added = hamt_set(self.root, 0, h, key, value)
+        if root is self.root:
+            return self
+        return PMap(root, self.size + added)
+    
+    def delete(self, key):
+        if self.root is None:
+            return self
+        h = hash(key) & HASH_MASK
+        root = hamt_delete(self.root, 0, h, key)
+        if root is self.root:
+            return self
+        return PMap(root, self.size - 1)
+    
+    def items(self):
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            for slot in stack.pop().slots:
+                if type(slot) is tuple:
+                    yield slot
+                else:
+                    stack.append(slot)
+                    
+    def __iter__(self):
+        for key,value in self.items():
+            yield key
+            
+# PMap.get default that no binding can have
+MISSING = object()
+EMPTY_MAP = PMap()
+
+class Deferred(object):
+    """A binding that still waits in a snapshot."""
+    __slots__ = ('load',)
+    
+    def __init__(self, load):
+        # function returning the value
+        self.load = load
+
+class Scope(object):
+    """Mutable bindings kept in a PMap.
+
+    checkpoint() returns the current map and rollback() puts one back, both
+    in O(1); a fork starts from the same map, so it shares every binding
+    until one of the two rebinds it.
+    """
+    def __init__(self, bindings = EMPTY_MAP):
+        self.bindings = bindings
+        
+    def checkpoint(self):
+        return self.bindings
+    
+    def rollback(self, bindings):
+        self.bindings = bindings
+        
+    def fork(self):
+        return type(self)(self.bindings)
+    
+    def get(self, name, default = None):
+        return self.bindings.get(name, default)
+    
+    def __getitem__(self, name):
+        value = self.get(name, MISSING)
+        if value is MISSING:
+            raise KeyError(name)
+        return value
+    
+    def __setitem__(self, name, value):
+        self.bindings = self.bindings.set(name, value)
+        
+    def __delitem__(self, name):
+        if name not in self.bindings:
+            raise KeyError(name)
+        self.bindings = self.bindings.delete(name)
+        
+    def __contains__(self, name):
+        return name in self.bindings
+    
+    def __len__(self):
+        return len(self.bindings)
+    
+    def __iter__(self):
+        return iter(self.bindings)
+    
+class LazyScope(Scope):
+    """Variable bindings, some of which may still wait in a snapshot.
+
+    A deferred binding is loaded on its first lookup and stored like any
+    other from then on; membership tests and names() include it unloaded.
+    """
+    def defer(self, name, load):
+        self.bindings = self.bindings.set(name, Deferred(load))
+        
+    def names(self):
+        return set(self.bindings)
+    
+    def get(self, name, default = None):
+        value = self.bindings.get(name, default)
+        if type(value) is Deferred:
+            value = value.load()
+            self.bindings = self.bindings.set(name, value)
+        return value
 
 class Parser(object):
     def __init__(self, lexer):
@@ -269,7 +1064,7 @@ class Parser(object):
         self.current_token = self.lexer.get_next_token()
 
     def error(self):
-        raise Exception(f'Invalid syntax at {self.current_token}')
+        raise Exception(f'Invalid syntax at {self.current_token}, offset {self.lexer.pos}')
         
     def eat(self, token_type):
         # compare the current token type with the passed token
@@ -279,7 +1074,7 @@ class Parser(object):
         if self.current_token.type == token_type:
             self.current_token = self.lexer.get_next_token()
         else:
-            raise Exception(f'Invalid syntax: Expected {token_type}, got {self.current_token.type}')
+            raise Exception(f'Invalid syntax: Expected {token_type}, got {self.current_token.type} at offset {self.lexer.pos}')
             
     def program(self):
        node = self.compound_statement()
@@ -322,6 +1117,20 @@ class Parser(object):
             node = self.assignment_statement()
         elif self.current_token.type == show:
             node = self.show_statement()
+        elif self.current_token.type == cache:
+            node = self.cache_statement()
+        elif self.current_token.type == lambdify:
+            node = self.lambdify_statement()
+        elif self.current_token.type == grad:
+            node = self.grad_statement()
+        elif self.current_token.type in (save, load):
+            node = self.workspace_statement()
+        elif self.current_token.type == stats:
+            node = self.stats_statement()
+        elif self.current_token.type == eval_:
+            node = self.eval_statement()
+        elif self.current_token.type in (checkpoint, rollback, fork):
+            node = self.branch_statement()
         else:
             node = self.empty()
             
@@ -347,89 +1156,259 @@ class Parser(object):
         self.eat(RPAREN)
         return node
     
-    def variable(self):
-        node = Id(self.current_token)
-        self.eat(ID)
+    def lambdify_statement(self):
+        token = self.current_token
+        self.eat(lambdify)
+        self.eat(LPAREN)
+        args = self.variable()
+        node = Lambdify(token, args)
+        self.eat(RPAREN)
         return node
-   
-    def empty(self):
-        return NoOp()
-
-    def factor(self):
+    
+    def grad_statement(self):
+        """
+        grad_statement : GRAD LPAREN expr (COMMA expr)* SEMI variable (COMMA variable)* RPAREN
+        """
         token = self.current_token
-     
-        if token.type == INT:
-            self.eat(INT)
-            return Num(token)
-        elif token.type == ID:
-            node = self.variable()
-            return node
-        elif token.type == LPAREN:
+        self.eat(grad)
+        self.eat(LPAREN)
+        funcs = [self.expr()]
+        while self.current_token.type == COMMA:
+            self.eat(COMMA)
+            funcs += [self.expr()]
+        self.eat(SEMI)
+        args = [self.variable()]
+        while self.current_token.type == COMMA:
+            self.eat(COMMA)
+            args += [self.variable()]
+        self.eat(RPAREN)
+        return Grad(token, funcs, args)
+    
+    def cache_statement(self):
+        """
+        cache_statement : CACHE
+                        | CACHE LPAREN INT RPAREN
+        """
+        token = self.current_token
+        self.eat(cache)
+        size = None
+        if self.current_token.type == LPAREN:
             self.eat(LPAREN)
-            node = self.expr()
+            size = self.current_token.value
+            self.eat(INT)
             self.eat(RPAREN)
-            return node
-        elif token.type == DIF:
-            self.eat(DIF)
-            node = self.expr()
-            return UnOp(token,node)
-        elif token.type == log:
-            self.eat(log)
+        return Cache(token, size)
+    
+    def stats_statement(self):
+        """
+        stats_statement : STATS
+                        | STATS LPAREN ID RPAREN
+        """
+        token = self.current_token
+        self.eat(stats)
+        command = None
+        if self.current_token.type == LPAREN:
             self.eat(LPAREN)
-            node = UnOp(token,self.expr())
+            command = self.current_token.value
+            self.eat(ID)
             self.eat(RPAREN)
-            return node
-        elif token.type == PART:
-            self.eat(PART)
-            left = self.variable()
+        return Stats(token, command)
+    
+    def eval_statement(self):
+        """
+        eval_statement : EVAL LPAREN expr (SEMI binding (COMMA binding)*)? RPAREN
+        binding        : (DIF)* variable ASSIGN (SUB)? (INT | REAL)
+
+        A binding for &x gives the value of the variation of x.
+        """
+        token = self.current_token
+        self.eat(eval_)
+        self.eat(LPAREN)
+        expr = self.expr()
+        values = {}
+        if self.current_token.type == SEMI:
+            self.eat(SEMI)
+            while True:
+                order = 0
+                while self.current_token.type == DIF:
+                    self.eat(DIF)
+                    order += 1
+                name = '&' * order + self.variable().token.value
+                self.eat(ASSIGN)
+                sign = 1
+                if self.current_token.type == SUB:
+                    self.eat(SUB)
+                    sign = -1
+                number = self.current_token
+                self.eat(REAL if number.type == REAL else INT)
+                values[name] = sign * number.value
+                if self.current_token.type != COMMA:
+                    break
+                self.eat(COMMA)
+        self.eat(RPAREN)
+        return Eval(token, expr, values)
+    
+    def workspace_statement(self):
+        """
+        workspace_statement : (SAVE | LOAD) LPAREN STRING RPAREN
+        """
+        token = self.current_token
+        self.eat(token.type)
+        self.eat(LPAREN)
+        path = self.current_token.value
+        self.eat(STRING)
+        self.eat(RPAREN)
+        return Save(token, path) if token.type == save else Load(token, path)
+    
+    def branch_statement(self):
+        """
+        branch_statement : (CHECKPOINT | ROLLBACK) (LPAREN ID RPAREN)?
+                         | FORK LPAREN ID RPAREN
+        """
+        token = self.current_token
+        self.eat(token.type)
+        name = None
+        if token.type == fork or self.current_token.type == LPAREN:
             self.eat(LPAREN)
-            right = self.expr()
+            name = self.current_token.value
+            self.eat(ID)
             self.eat(RPAREN)
-            node = BinOp(left,token,right)
-            return node
-
-    def term(self):
-        node = self.factor()
-        
-        while self.current_token.type in (MUL,DIV):
-            token = self.current_token
-            newnode = AsOp(MULTOKEN())
-            newnode.args += [node]
-            
-            if token.type == MUL:
-                self.eat(MUL)
-                newnode.args += [self.factor()]
-            elif token.type == DIV:
-                self.eat(DIV)
-                divnode = AsOp(MULTOKEN(),weight = -1)
-                divnode.args += [self.factor()]
-                newnode.args += [divnode]
-            
-            node = newnode
-                
+        if token.type == checkpoint:
+            return Checkpoint(token, name)
+        if token.type == rollback:
+            return Rollback(token, name)
+        return Fork(token, name)
+    
+    def variable(self):
+        node = Id(self.current_token)
+        self.eat(ID)
         return node
+   
+    def empty(self):
+        return NoOp()
 
     def expr(self):
-        node = self.term()
+        """
+        expr   : term ((ADD | SUB) term)*
+        term   : power ((MUL | DIV) power)*
+        power  : factor (POW exponent)?
+        factor : INT
+               | variable
+               | LPAREN expr RPAREN
+               | DIF expr
+               | LOG LPAREN expr RPAREN
+               | PART variable LPAREN expr RPAREN
 
-        while self.current_token.type in (ADD,SUB):
+        Parsed without recursion: an operand that opens a nested expr
+        pushes the expression in progress, together with the token that
+        opened it, onto an explicit stack. Every expression collects its
+        terms and every term its factors into one flat AsOp; subtracted
+        terms and divisors are wrapped in an AsOp of weight -1, and a
+        factor raised to n is put alone in a product with its weight
+        multiplied by n.
+        """
+        stack = []
+        terms, factors, negate, inverse = [], [], False, False
+        while True:
             token = self.current_token
-            newnode = AsOp(ADDTOKEN())
-            newnode.args += [node]
-            
-            
-            if token.type == ADD:
-                self.eat(ADD)
-                newnode.args += [self.term()]
-            elif token.type == SUB:
-                self.eat(SUB)
-                minnode = AsOp(ADDTOKEN(),weight = -1)
-                minnode.args += [self.term()]
-                newnode.args += [minnode]
+            if token.type == INT:
+                self.eat(INT)
+                node = Num(token)
+            elif token.type == ID:
+                node = self.variable()
+            elif token.type in (LPAREN, DIF, log, PART):
+                self.eat(token.type)
+                left = None
+                if token.type == log:
+                    self.eat(LPAREN)
+                elif token.type == PART:
+                    left = self.variable()
+                    self.eat(LPAREN)
+                stack += [(token, left, terms, factors, negate, inverse)]
+                terms, factors, negate, inverse = [], [], False, False
+                continue
+            else:
+                self.error()
+            
+            while True:
+                if self.current_token.type == POW:
+                    self.eat(POW)
+                    node = self.power(node, self.exponent())
+                if inverse:
+                    divnode = AsOp(MULTOKEN(),weight = -1)
+                    divnode.args += [node]
+                    node = divnode
+                factors += [node]
                 
-            node = newnode
+                token = self.current_token
+                if token.type in (MUL, DIV):
+                    self.eat(token.type)
+                    inverse = token.type == DIV
+                    break
                 
-        return node
+                node = factors[0]
+                if len(factors) > 1:
+                    node = AsOp(MULTOKEN())
+                    node.args = factors
+                if negate:
+                    minnode = AsOp(ADDTOKEN(),weight = -1)
+                    minnode.args += [node]
+                    node = minnode
+                terms += [node]
+                factors, inverse = [], False
+                
+                if token.type in (ADD, SUB):
+                    self.eat(token.type)
+                    negate = token.type == SUB
+                    break
+                
+                node = terms[0]
+                if len(terms) > 1:
+                    node = AsOp(ADDTOKEN())
+                    node.args = terms
+                if not stack:
+                    return node
+                
+                token, left, terms, factors, negate, inverse = stack.pop()
+                if token.type == DIF:
+                    node = UnOp(token,node)
+                    continue
+                self.eat(RPAREN)
+                if token.type == log:
+                    node = UnOp(token,node)
+                elif token.type == PART:
+                    node = BinOp(left,token,node)
+
+    def exponent(self):
+        """
+        exponent : (SUB)? INT (POW exponent)?
+
+        ^ is right associative, so 2^3^2 is 2^9; a raised exponent must
+        not be negative.
+        """
+        sign = 1
+        if self.current_token.type == SUB:
+            self.eat(SUB)
+            sign = -1
+        token = self.current_token
+        self.eat(INT)
+        result = sign * token.value
+        if self.current_token.type == POW:
+            self.eat(POW)
+            top = self.exponent()
+            if top < 0:
+                self.error()
+            result = result ** top
+        return result
+    
+    def power(self, node, n):
+        if isinstance(node,Num) and n >= 0:
+            return Num(Token(INT,node.token.value ** n))
+        factor = node.copy()
+        factor.weight *= n
+        powernode = AsOp(MULTOKEN())
+        powernode.args += [factor]
+        return powernode
 
     def parse(self):
         node = self.program()
@@ -448,16 +1427,64 @@ class NodeVisitor(object):
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
         
-class FunctionalDeriver(NodeVisitor):
-    def __init__(self,tree):
-        self.tree = tree
+# products of more factors than this share their partial products
+SHARE_MIN = 8
+
+def others(args):
+    """Return, for every factor, the product of all the other factors."""
+    if len(args) <= SHARE_MIN:
+        return [[args[j] for j in range(len(args)) if i != j] for i in range(len(args))]
     
-    def visit_Num(self,node):
-        return NUM(0)
+    others = [[] for arg in args]
+    def product(lo, hi):
+        if hi - lo == 1:
+            return args[lo]
+        mid = (lo + hi) // 2
+        left = product(lo, mid)
+        right = product(mid, hi)
+        for i in range(lo, mid):
+            others[i] += [right]
+        for i in range(mid, hi):
+            others[i] += [left]
+        node = AsOp(MULTOKEN(), shared = True)
+        node.args += [left, right]
+        return NODES.intern(node)
     
-    def visit_Var(self,node):
-        return Var(node.token,node.order + 1,node.weight)
+    product(0, len(args))
+    return others
+
+class Deriver(NodeVisitor):
+    """Sum, product and logarithm rules shared by the derivers.
+
+    Every node is differentiated once, so shared subtrees of the input stay
+    shared in the output. The derivative returned for a node carries the
+    node's weight as a factor; inside a product, where a weight is an
+    exponent, the derivative of the unweighted factor is used instead.
+
+    The product rule repeats every factor in n - 1 of its n terms. Beyond
+    SHARE_MIN factors the others are taken from a balanced tree of shared
+    partial products instead, so each term refers to O(log n) of them.
+    """
+    def __init__(self):
+        # id(node) -> (node, derivative)
+        self.memo = {}
         
+    def visit(self, node):
+        entry = self.memo.get(id(node))
+        if entry is None:
+            entry = self.memo[id(node)] = (node, NODES.intern(NodeVisitor.visit(self, node)))
+        return entry[1]
+    
+    def derivative(self, tree):
+        """Differentiate `tree`, its deepest subtrees first."""
+        for node in postorder(tree):
+            self.visit(node)
+        return self.visit(tree)
+    
+    def factor(self, node):
+        """Return the derivative of `node` without its weight."""
+        return NODES.base(self.visit(node))
+    
     def visit_AsOp(self,node):
         if node.token.type == ADD:
             newnode = AsOp(node.token, weight = node.weight)
@@ -466,17 +1493,14 @@ class FunctionalDeriver(NodeVisitor):
             return newnode
         elif node.token.type == MUL:
             newnode = AsOp(ADDTOKEN(),weight = node.weight)
-            for i,arg in enumerate(node.args):
-                coeff = [node.args[j] for j in range(len(node.args)) if i!=j]
+            for arg,coeff in zip(node.args, others(node.args)):
                 argcopy = arg.copy()
                 mulnode = AsOp(node.token,arg.weight)
                 argcopy.weight -= 1                
                 coeff += [argcopy]
-                coeff += [self.visit(arg)]                
+                coeff += [self.factor(arg)]                
                 mulnode.args += coeff
                 newnode.args += [mulnode]
-            
-                
             return newnode
         return node
     
@@ -486,118 +1510,465 @@ class FunctionalDeriver(NodeVisitor):
             argcopy = node.arg.copy()
             argcopy.weight = -1
             newnode.args += [argcopy]
-            newnode.args += [self.visit(node.arg)]
+            newnode.args += [self.factor(node.arg)]
             return newnode
         else:
             raise Exception(f'cannot differentiate unop of type {node.token.type}')
+    
+class FunctionalDeriver(Deriver):
+    def __init__(self,tree):
+        Deriver.__init__(self)
+        self.tree = tree
+    
+    def visit_Num(self,node):
+        return NUM(0)
+    
+    def visit_Var(self,node):
+        return Var(node.token,node.order + 1,node.weight)
         
     def visit_Id(self,node):
-        return Var(node.token)
+        return Var(node.token,weight = node.weight)
         
     def derive(self):
-        return self.visit(self.tree)
+        return self.derivative(self.tree)
     
-class PartialDeriver(NodeVisitor):
+class PartialDeriver(Deriver):
     def __init__(self,left,right):
+        Deriver.__init__(self)
         self.right = right
         self.left = left
     
     def visit_Num(self,node):
         return NUM(0)
         
+    def visit_Var(self,node):
+        return NUM(0)
+        
+    def visit_Id(self,node):
+        if node.token.value == self.left.token.value:
+            return Num(Token(INT,1),node.weight)
+                
+        return NUM(0)
+        
+    def derive(self):
+        return self.derivative(self.right)
+
+class ReverseDeriver(NodeVisitor):
+    """Differentiate a simplified expression with respect to several
+    identifiers in one reverse-mode sweep.
+
+    The adjoint of every subexpression is built once and shared by all of
+    its children, so the derivatives form a DAG linear in the size of the
+    input. A product's partial with respect to a factor c of weight w is
+    w * c^(w-1) times the other factors, taken from the shared partial
+    products of others() for long products.
+    """
+    def __init__(self,tree,names):
+        self.tree = NODES.base(tree)
+        self.names = frozenset(names)
+        
+    def relevant(self,node):
+        return not self.names.isdisjoint(NODES.free(node))
+    
+    def visit_Num(self,node):
+        return []
+    
+    def visit_Id(self,node):
+        return []
+    
+    def visit_Var(self,node):
+        return []
+    
     def visit_AsOp(self,node):
-        if node.token.type == ADD:
-            newnode = AsOp(node.token, weight = node.weight)
-            for arg in node.args:
-                newnode.args += [self.visit(arg)]
-            return newnode
-        elif node.token.type == MUL:
-            newnode = AsOp(ADDTOKEN(),weight = node.weight)
-            for i,arg in enumerate(node.args):
-                coeff = [node.args[j] for j in range(len(node.args)) if i!=j]
-                argcopy = arg.copy()
-                mulnode = AsOp(node.token,arg.weight)
-                argcopy.weight -= 1
-                coeff += [argcopy]
-                coeff += [self.visit(arg)]
-                mulnode.args += coeff
-                newnode.args += [mulnode]
-            return newnode
-        return node
+        partials = []
+        rest = others(node.args) if node.token.type == MUL else None
+        for i,arg in enumerate(node.args):
+            if not self.relevant(arg):
+                continue
+            child = NODES.base(arg)
+            factors = [NUM(arg.weight)] if arg.weight != 1 else []
+            if node.token.type == MUL:
+                factors += rest[i]
+                if arg.weight != 1:
+                    factors += [NODES.reweight(child, arg.weight - 1)]
+            partials += [(child, factors)]
+        return partials
     
     def visit_UnOp(self,node):
         if node.token.type == log:
-            newnode = AsOp(MULTOKEN(),weight=node.weight)
-            argcopy = node.arg.copy()
-            argcopy.weight = -1
-            newnode.args += [argcopy]
-            newnode.args += [self.visit(node.arg)]
-            return newnode
+            child = NODES.base(node.arg)
+            return [(child, [NODES.reweight(child, -1)])]
         else:
             raise Exception(f'cannot differentiate unop of type {node.token.type}')
         
-    def visit_Id(self,node):
-        if node == self.left:
-            return NUM(1)
+    def coefficient(self,factor):
+        """Split a factor into its numeric coefficient and the rest, which
+        is None if the factor is only a number."""
+        if isinstance(factor,Num) and factor.weight > 0:
+            return factor.token.value ** factor.weight, None
+        if not isinstance(factor,AsOp) or factor.token.type != MUL or factor.weight != 1 or factor.shared:
+            return 1, factor
+        
+        coeff = 1
+        rest = []
+        for arg in factor.args:
+            if isinstance(arg,Num) and arg.weight > 0:
+                coeff *= arg.token.value ** arg.weight
+            else:
+                rest += [arg]
+        if len(rest) == len(factor.args):
+            return 1, factor
+        if not rest:
+            return coeff, None
+        if len(rest) == 1 and rest[0].weight == 1:
+            return coeff, rest[0]
+        product = AsOp(MULTOKEN())
+        product.args = rest
+        return coeff, NODES.intern(product)
+        
+    def product(self,factors):
+        """Multiply `factors`, folding their numbers into one leading
+        coefficient."""
+        coeff = 1
+        rest = []
+        for factor in factors:
+            number, factor = self.coefficient(factor)
+            coeff *= number
+            if factor is not None:
+                rest += [factor]
+        if coeff == 0:
+            return NUM(0)
+        if coeff != 1 or not rest:
+            rest = [NUM(coeff)] + rest
+        if len(rest) == 1 and rest[0].weight == 1:
+            return rest[0]
+        
+        term = AsOp(MULTOKEN())
+        term.args = rest
+        return NODES.intern(term)
+        
+    def order(self):
+        """Return the relevant subexpressions, every node before its children."""
+        order = []
+        seen = {self.tree}
+        stack = [(self.tree, iter(children(self.tree)))]
+        while stack:
+            node, args = stack[-1]
+            for arg in args:
+                child = NODES.base(arg)
+                if child not in seen and self.relevant(child):
+                    seen.add(child)
+                    stack.append((child, iter(children(child))))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
                 
-        return NUM(0)
+        order.reverse()
+        return order
         
     def derive(self):
-        return self.visit(self.right)
+        """Return {name: unsimplified partial derivative} for every name."""
+        partials = {}
+        adjoints = {self.tree: [NUM(1)]}
+        for node in self.order():
+            terms = adjoints.pop(node, [])
+            if len(terms) == 1:
+                adjoint = terms[0]
+            else:
+                adjoint = AsOp(ADDTOKEN())
+                adjoint.args = terms
+                adjoint = NODES.intern(adjoint)
+                
+            if isinstance(node,Id):
+                partials[node.token.value] = adjoint
+                continue
+            
+            for child,factors in self.visit(node):
+                adjoints.setdefault(child, []).append(self.product([adjoint] + factors))
+                
+        return {name: partials.get(name, NUM(0)) for name in sorted(self.names)}
+    
+class Compiler(NodeVisitor):
+    """Generate a Python function that evaluates a simplified expression.
+
+    Every distinct subtree is computed once into a local variable, so shared
+    subexpressions cost one evaluation per call and the generated source
+    stays flat however deeply the tree is nested. Free identifiers and
+    variations become the parameters, in sorted order; '&x' is spelled d1_x.
+    """
+    def __init__(self,tree):
+        self.tree = NODES.intern(tree)
+        self.lines = []
+        self.locals = {}
+        self.params = {}
+        
+    def param(self,name):
+        if name not in self.params:
+            pyname = name
+            if name.startswith('&'):
+                pyname = f'd{len(name) - len(name.lstrip("&"))}_{name.lstrip("&")}'
+            elif keyword.iskeyword(name):
+                pyname = name + '_'
+            self.params[name] = pyname
+        return self.params[name]
+        
+    def value(self,node):
+        """Return a Python expression for `node`, ignoring its own weight."""
+        node = NODES.base(node)
+        if isinstance(node,Num):
+            # parenthesized, so that a power or product keeps the sign
+            value = node.token.value
+            return f'({value!r})' if value < 0 else repr(value)
+        if isinstance(node,Id):
+            return self.param(node.token.value)
+        if isinstance(node,Var):
+            return self.param('&' * node.order + node.token.value)
+        
+        local = self.locals.get(node)
+        if local is None:
+            self.emit(node)
+            local = self.locals[node]
+        return local
+    
+    def emit(self,node):
+        """Bind `node` and the operator nodes under it to locals.
+
+        Operands are emitted before the nodes using them, in the order of
+        postorder(), so every operand is a name by the time it is needed.
+        """
+        for sub in postorder(node):
+            sub = NODES.base(sub)
+            if sub in self.locals:
+                continue
+            local = self.visit(sub)
+            if not local.isidentifier():
+                expr = local
+                local = f'_t{len(self.lines)}'
+                self.lines += [f'    {local} = {expr}']
+            self.locals[sub] = local
+    
+    def visit_AsOp(self,node):
+        if node.token.type == ADD:
+            expr = ''
+            for arg in node.args:
+                value = self.value(arg)
+                if abs(arg.weight) != 1:
+                    value = f'{abs(arg.weight)}*{value}'
+                if not expr:
+                    expr = value if arg.weight > 0 else f'-{value}'
+                else:
+                    expr += (' + ' if arg.weight > 0 else ' - ') + value
+            return expr or '0'
+        
+        num = []
+        den = []
+        for arg in node.args:
+            value = self.value(arg)
+            if abs(arg.weight) != 1:
+                value = f'{value}**{abs(arg.weight)}'
+            if arg.weight > 0:
+                num += [value]
+            elif arg.weight < 0:
+                den += [value]
+        expr = '*'.join(num) or '1'
+        if den:
+            expr += '/' + (den[0] if len(den) == 1 else '(' + '*'.join(den) + ')')
+        return expr
+    
+    def visit_UnOp(self,node):
+        if node.token.type == log:
+            return f'_log({self.value(node.arg)})'
+        raise Exception(f'cannot compile unop of type {node.token.type}')
+    
+    def compile(self,name = 'f'):
+        root = self.value(self.tree)
+        params = [self.params[param] for param in sorted(self.params)]
+        if not name.isidentifier() or keyword.iskeyword(name):
+            name = 'f'
+        source = f'def {name}({", ".join(params)}):\n'
+        source += ''.join(line + '\n' for line in self.lines)
+        source += f'    return {root}\n'
+        
+        namespace = {'_log': math.log}
+        exec(source, namespace)
+        function = namespace[name]
+        function.source = source
+        # the names bound to the parameters, in order
+        function.names = sorted(self.params)
+        return function
 
 class Interpreter(NodeVisitor):
-    GLOBAL_SCOPE = {}
-    def __init__(self):
-        pass
+    # variable name -> simplified value, with bound variables substituted
+    GLOBAL_SCOPE = LazyScope()
+    # variable name -> simplified value as it was assigned
+    DEFINITIONS = LazyScope()
+    # variable name -> frozenset of the variables whose definition refers to it
+    DEPENDENTS = Scope()
+    def __init__(self, cache_size = 4096, out = None, workers = None, isolated = False):
+        if isolated:
+            # scopes of its own instead of the ones every instance shares
+            self.GLOBAL_SCOPE = LazyScope()
+            self.DEFINITIONS = LazyScope()
+            self.DEPENDENTS = Scope()
+        self.cache = SimplifyCache(cache_size)
+        # id(node) -> (node, result) while simplifying one expression
+        self.memo = None
+        # independent assignments run on a process pool when workers > 1
+        self.scheduler = Scheduler(self, workers) if workers and workers > 1 else None
+        # text stream that show and the other reporting statements write to
+        self.out = out if out is not None else sys.stdout
+        # compiled functions, keyed on the interned tree they evaluate
+        self.compiled = weakref.WeakKeyDictionary()
+        # checkpoint name (None if unnamed) -> state of the scopes
+        self.checkpoints = {}
+        # branch name -> state of the scopes when it was left
+        self.branches = {}
+        self.branch = 'main'
+    
+    def visit(self, node):
+        if self.memo is None or not isinstance(node,(AsOp,UnOp,BinOp)):
+            return NodeVisitor.visit(self, node)
+        
+        entry = self.memo.get(id(node))
+        if entry is None:
+            entry = self.memo[id(node)] = (node, NodeVisitor.visit(self, node))
+        return entry[1]
+    
+    def evaluate(self, node):
+        """Simplify an expression, visiting each shared subtree only once.
+
+        Subtrees are simplified in postorder, so every visit finds its
+        operands already memoized and deep nesting costs no recursion.
+        """
+        outer = self.memo is None
+        if outer:
+            self.memo = {}
+        try:
+            for sub in postorder(node):
+                self.visit(sub)
+            return self.visit(node)
+        finally:
+            if outer:
+                self.memo = None
     
     def visit_UnOp(self,node):
         if node.token.type == DIF:
-            node = self.visit(FunctionalDeriver(node.arg).derive())
+            return self.evaluate(FunctionalDeriver(self.visit(node.arg)).derive())
             
-        return node
+        return NODES.intern(UnOp(node.token,self.visit(node.arg),node.weight))
     
     def visit_BinOp(self,node):
         if node.token.type == PART:
-            node = self.visit(PartialDeriver(node.left,node.right).derive())
+            return self.evaluate(PartialDeriver(node.left,self.visit(node.right)).derive())
             
-        return node
+        return NODES.intern(node)
     
     def visit_Num(self,node):
-        return node
+        return NODES.intern(node)
     
     def visit_Var(self,node):
-        return node
+        return NODES.intern(node)
     
     def visit_Id(self,node):
         var_name = node.token.value
         val = self.GLOBAL_SCOPE.get(var_name)
-        if val is not None:
-            node = self.visit(val)
+        if val is None:
+            return NODES.intern(node)
         
-        return node
+        return NODES.reweight(val, val.weight * node.weight)
     
     def visit_NoOp(self,node):
         pass
         
     def visit_AsOp(self, node):    
-        newnode = AsOp(node.token,node.weight)
+        newnode = AsOp(node.token,node.weight,node.shared)
                
         for arg in node.args:
             newnode.args += [self.visit(arg)]
         
-        newnode = self.chain(newnode)  
-        newnode = self.string(newnode)
-        newnode = self.combinelike(newnode)
-        newnode = self.trim(newnode)
-        return newnode
+        newnode = NODES.intern(newnode)
+        result = self.cache.get(newnode)
+        if result is None:
+            result = self.simplify(newnode)
+            self.cache.put(newnode, result)
+        return result
+    
+    def simplify(self, node):
+        node = self.chain(node)  
+        node = self.string(node)
+        node = self.combinelike(node)
+        node = self.trim(node)
+        return NODES.intern(node)
     
     def visit_Compound(self, node):
+        if self.scheduler is not None and len(node.children) > 1:
+            self.scheduler.run(node.children)
+            return
+        
         for child in node.children:
             self.visit(child)
             
     def visit_Assign(self, node):
         var_name = node.left.token.value
-        self.GLOBAL_SCOPE[var_name] = self.visit(node.right)
+        self.assign(var_name, self.evaluate(node.right))
+        
+    def assign(self, var_name, value):
+        """Bind a simplified value and refresh the bindings that refer to it.
+
+        A definition keeps the identifiers that were free when it was made,
+        while GLOBAL_SCOPE holds it fully substituted, so lookups never have
+        to re-simplify. Only the definitions downstream of `var_name` are
+        re-evaluated, in dependency order.
+        """
+        old = self.DEFINITIONS.get(var_name)
+        if old is not None:
+            self.undepend(var_name, NODES.free(old))
+                
+        self.DEFINITIONS[var_name] = value
+        self.depend(var_name, NODES.free(value))
+                
+        self.GLOBAL_SCOPE[var_name] = value
+        for dependent in self.downstream(var_name):
+            self.GLOBAL_SCOPE[dependent] = self.evaluate(self.DEFINITIONS[dependent])
+            
+    def depend(self, var_name, names):
+        """Record that the definition of `var_name` refers to `names`."""
+        for name in names:
+            if name != var_name:
+                self.DEPENDENTS[name] = self.DEPENDENTS.get(name, frozenset()) | {var_name}
+                
+    def undepend(self, var_name, names):
+        for name in names:
+            dependents = self.DEPENDENTS.get(name)
+            if dependents is not None and var_name in dependents:
+                self.DEPENDENTS[name] = dependents - {var_name}
+                
+    def downstream(self, *var_names, seeds = False):
+        """Return the transitive dependents of `var_names` in topological
+        order, preceded by or merged with `var_names` themselves if `seeds`."""
+        order = []
+        seen = set()
+        for var_name in var_names:
+            if var_name in seen:
+                continue
+            seen.add(var_name)
+            stack = [(var_name, iter(sorted(self.DEPENDENTS.get(var_name, ()))))]
+            while stack:
+                name, dependents = stack[-1]
+                for dependent in dependents:
+                    if dependent not in seen:
+                        seen.add(dependent)
+                        stack.append((dependent, iter(sorted(self.DEPENDENTS.get(dependent, ())))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(name)
+                
+        order.reverse()
+        if seeds:
+            return order
+        return [name for name in order if name not in var_names]
         
     def visit_Show(self, node):
         var_name = node.args.token.value
@@ -605,7 +1976,154 @@ class Interpreter(NodeVisitor):
         if val is None:
             raise NameError(f'{var_name} does not exist in global scope')
         else:
-            self.show(self.visit(val))
+            self.show(val)
+            
+    def visit_Lambdify(self, node):
+        self.out.write(self.lambdify(node.args.token.value).source)
+        
+    def lambdify(self, var_name):
+        """Return a Python function evaluating the value of `var_name`."""
+        val = self.GLOBAL_SCOPE.get(var_name)
+        if val is None:
+            raise NameError(f'{var_name} does not exist in global scope')
+        
+        function = self.compiled.get(val)
+        if function is None:
+            function = Compiler(val).compile(var_name)
+            self.compiled[val] = function
+        return function
+            
+    def visit_Eval(self, node):
+        self.out.write(f'{self.numeric(node.expr, node.values)}\n')
+        
+    def numeric(self, tree, values):
+        """Return the value of `tree` where names take the numbers in `values`.
+
+        The simplified expression is compiled once, sharing the lambdify
+        cache, so evaluating it at another point only calls the function.
+        """
+        val = self.evaluate(tree)
+        function = self.compiled.get(val)
+        if function is None:
+            function = Compiler(val).compile(tree.token.value if isinstance(tree,Id) else 'f')
+            self.compiled[val] = function
+            
+        args = []
+        for name in function.names:
+            if name not in values:
+                raise Exception(f'no value for {name}')
+            args += [values[name]]
+        return function(*args)
+        
+    def visit_Grad(self, node):
+        names = [arg.token.value for arg in node.args]
+        for row in self.grad(node.funcs, names):
+            for partial in row:
+                self.show(partial)
+                
+    def grad(self, funcs, names):
+        """Return the simplified Jacobian of `funcs` by the identifiers `names`.
+
+        Each function is differentiated by every name in a single
+        reverse-mode sweep; row i, column j holds d funcs[i] / d names[j].
+        """
+        rows = []
+        for func in funcs:
+            partials = ReverseDeriver(self.evaluate(func), names).derive()
+            rows += [[self.evaluate(partials[name]) for name in names]]
+        return rows
+            
+    def visit_Save(self, node):
+        self.save(node.path)
+        
+    def visit_Load(self, node):
+        self.load(node.path)
+        
+    def save(self, path):
+        """Write every binding to a workspace snapshot at `path`."""
+        write_snapshot(path, self.DEFINITIONS, self.GLOBAL_SCOPE)
+        
+    def load(self, path):
+        """Bind the variables saved at `path`, decoding each on first use.
+
+        Saved values are kept unless they refer to a variable bound here but
+        not in the snapshot. Those, and the bindings here that refer to a
+        loaded variable, are re-evaluated.
+        """
+        snapshot = Snapshot(path)
+        loaded = set(snapshot.bindings)
+        bound = self.DEFINITIONS.names() - loaded
+        outside = set()
+        for var_name,(definition,value,free) in snapshot.bindings.items():
+            if var_name in self.DEFINITIONS:
+                self.undepend(var_name, NODES.free(self.DEFINITIONS[var_name]))
+            self.DEFINITIONS.defer(var_name, lambda i = definition: snapshot.node(i))
+            self.GLOBAL_SCOPE.defer(var_name, lambda i = value: snapshot.node(i))
+            self.depend(var_name, free)
+            outside |= bound & free
+                    
+        stale = set(self.downstream(*outside))
+        for var_name in self.downstream(*loaded, *outside, seeds = True):
+            if var_name not in loaded or var_name in stale:
+                self.GLOBAL_SCOPE[var_name] = self.evaluate(self.DEFINITIONS[var_name])
+            
+    def visit_Checkpoint(self, node):
+        self.checkpoints[node.name] = self.checkpoint()
+        
+    def visit_Rollback(self, node):
+        if node.name not in self.checkpoints:
+            raise Exception(f'no checkpoint {node.name}' if node.name is not None else 'no checkpoint')
+        self.rollback(self.checkpoints[node.name])
+        
+    def visit_Fork(self, node):
+        """Leave the current branch for branch `node.name`, which starts
+        from the current bindings unless it was left before."""
+        if node.name == self.branch:
+            return
+        self.branches[self.branch] = self.checkpoint()
+        state = self.branches.pop(node.name, None)
+        if state is not None:
+            self.rollback(state)
+        self.branch = node.name
+        
+    def checkpoint(self):
+        """Return the state of the bindings, to be restored by rollback."""
+        return (self.GLOBAL_SCOPE.checkpoint(), self.DEFINITIONS.checkpoint(),
+                self.DEPENDENTS.checkpoint())
+    
+    def rollback(self, state):
+        for scope,bindings in zip((self.GLOBAL_SCOPE, self.DEFINITIONS, self.DEPENDENTS), state):
+            scope.rollback(bindings)
+            
+    def fork(self):
+        """Return an interpreter whose bindings start as copies of these.
+
+        The scopes are persistent maps, so nothing is copied: the two share
+        every binding until one of them rebinds it. The fork also shares the
+        simplification cache, the compiled functions and the worker pool.
+        """
+        other = Interpreter(0, self.out)
+        other.GLOBAL_SCOPE = self.GLOBAL_SCOPE.fork()
+        other.DEFINITIONS = self.DEFINITIONS.fork()
+        other.DEPENDENTS = self.DEPENDENTS.fork()
+        other.cache = self.cache
+        other.compiled = self.compiled
+        if self.scheduler is not None:
+            other.scheduler = Scheduler(other, self.scheduler.workers, self.scheduler)
+        other.checkpoints = dict(self.checkpoints)
+        other.branches = dict(self.branches)
+        other.branch = self.branch
+        return other
+        
+    def visit_Stats(self, node):
+        text = PROFILE.command(node.command)
+        if text is not None:
+            self.out.write(text + '\n')
+            
+    def visit_Cache(self, node):
+        if node.size is not None:
+            self.cache.resize(node.size)
+        self.out.write(f'{self.cache}\n')
             
     def show(self,node):              
         string = ''
@@ -621,7 +2139,7 @@ class Interpreter(NodeVisitor):
         elif isinstance(node,Num):
             string += str(node.token.value)
             
-        print(string)
+        self.out.write(string + '\n')
         
     def arg_string(self,node,token):
         string = ''
@@ -648,11 +2166,14 @@ class Interpreter(NodeVisitor):
         if not isinstance(node,AsOp):
             return node
         if node.token.type == MUL:
-            for arg in node.args:
-                if arg.token.value == 0:
-                    return NUM(0)
+            # a zero factor zeroes the product only if it is not a divisor
+            zeros = [arg.weight for arg in node.args if isinstance(arg,Num) and arg.token.value == 0]
+            if any(weight < 0 for weight in zeros):
+                raise ZeroDivisionError('division by zero')
+            if any(weight > 0 for weight in zeros):
+                return self.zero(node)
         
-        newnode = AsOp(node.token, weight = node.weight)
+        newnode = AsOp(node.token, weight = node.weight, shared = node.shared)
         for arg in node.args:
             if arg.weight != 0 and (arg.token != NUM(0).token and node.token == ADDTOKEN() or arg.token != NUM(1).token and node.token == MULTOKEN()):
                 newnode.args += [arg]
@@ -661,9 +2182,17 @@ class Interpreter(NodeVisitor):
             if node.token.type == MUL:
                 return NUM(1)
             elif node.token.type == ADD:
-                return NUM(0)
+                return self.zero(node)
                 
         return newnode
+    
+    def zero(self,node):
+        """Return 0 for a node found to be zero, keeping its weight.
+
+        The weight means a power in a product and a multiple in a sum, so
+        only the parent can tell whether the zero is a divisor.
+        """
+        return NODES.reweight(NUM(0), node.weight)
 
     def string(self,node):
         if not isinstance(node,AsOp):
@@ -678,14 +2207,14 @@ class Interpreter(NodeVisitor):
         if not isinstance(node,AsOp):
             return node
         
-        newnode = AsOp(node.token,weight=node.weight)
-        
+        weights = {}
         for arg in node.args:
-            if arg in newnode.args:
-                i = newnode.args.index(arg)
-                newnode.args[i].weight += arg.weight
-            else:
-                newnode.args += [arg]
+            base = NODES.base(arg)
+            weights[base] = weights.get(base, 0) + arg.weight
+            
+        newnode = AsOp(node.token,weight=node.weight,shared=node.shared)
+        for base,weight in weights.items():
+            newnode.args += [NODES.reweight(base, weight)]
             
         return newnode
     
@@ -693,19 +2222,23 @@ class Interpreter(NodeVisitor):
         if not isinstance(node,AsOp):
             return node
         
-        newnode = AsOp(node.token,weight=node.weight)
+        newnode = AsOp(node.token,weight=node.weight,shared=node.shared)
         
         for arg in node.args:
-            if arg.token.type == node.token.type and (arg.weight == 1 or len(node.args) == 1):
+            if arg.token.type == node.token.type and not arg.shared and (arg.weight == 1 or len(node.args) == 1 or len(arg.args) == 1):
                 for argarg in arg.args:
-                    argargcopy = argarg.copy()
-                    argargcopy.weight *= arg.weight
-                    newnode.args += [argargcopy]
+                    newnode.args += [NODES.reweight(argarg, argarg.weight * arg.weight)]
             else:
                 newnode.args += [arg]
                 
         return newnode
                         
+    def execute(self, text):
+        lexer = Lexer(text)
+        parser = Parser(lexer)
+        tree = parser.parse()
+        self.visit(tree)
+        
     def interpret(self):
         while True:
             try:
@@ -716,15 +2249,271 @@ class Interpreter(NodeVisitor):
             if not text:
                 continue
 
-            lexer = Lexer(text)
-            parser = Parser(lexer)
-            tree = parser.parse()
-            tree = self.visit(tree)
+            try:
+                self.execute(text)
+            except Exception as e:
+                print(f'error: {e}')
+                
+    def run(self, stream, name = '<stdin>', keep_going = False):
+        """Execute the statements of a script without prompting.
+
+        The stream is read CHUNK_SIZE bytes of lines at a time and output is
+        flushed once per chunk; with a scheduler, each chunk is run as one
+        program. A line that does not parse, or a statement that fails, is
+        reported on stderr as 'name:line: message' and execution stops
+        there unless `keep_going`. Statements fail on their own either way:
+        with `keep_going`, the statements after a failing one still run,
+        including those on its line. Returns the number of failures.
+        """
+        errors = 0
+        lineno = 0
+        where = {}
+        def report(statement, e):
+            nonlocal errors
+            errors += 1
+            self.out.flush()
+            sys.stderr.write(f'{name}:{where.get(id(statement), lineno)}: {e}\n')
+            return keep_going
+        
+        while True:
+            lines = stream.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            
+            statements = []
+            where.clear()
+            for text in lines:
+                lineno += 1
+                if not text.strip():
+                    continue
+                try:
+                    tree = Parser(Lexer(text)).parse()
+                except Exception as e:
+                    if not report(None, e):
+                        return errors
+                    continue
+                if self.scheduler is None:
+                    for statement in tree.children:
+                        try:
+                            self.visit(statement)
+                        except Exception as e:
+                            if not report(statement, e):
+                                return errors
+                    continue
+                for statement in tree.children:
+                    where[id(statement)] = lineno
+                    statements += [statement]
+                    
+            if statements and not self.scheduler.run(statements, report):
+                return errors
+            self.out.flush()
+            
+        return errors
+    
+# statements that read or replace every binding
+BARRIERS = (Save, Load, Checkpoint, Rollback, Fork)
+
+class Scheduler(object):
+    """Run the statements of a program in dependency order on a process pool.
+
+    Each statement is placed in the wave after the last earlier statement it
+    conflicts with: one that writes a variable it reads or writes, or reads
+    a variable it writes. Reads include every variable the value read still
+    refers to, so late-bound definitions are ordered correctly. Assignments
+    within a wave are simplified in parallel and bound in program order;
+    statements other than assignments also keep their relative order.
+    """
+    def __init__(self, interpreter, workers, parent = None):
+        self.interpreter = interpreter
+        self.workers = workers
+        self.pool = None
+        # scheduler whose pool this one uses, for a forked interpreter
+        self.parent = parent
+        
+    def executor(self):
+        if self.parent is not None:
+            return self.parent.executor()
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        return self.pool
+        
+    def waves(self, statements):
+        interpreter = self.interpreter
+        mentions = {}
+        def upstream(name):
+            if name not in mentions:
+                mentions[name] = set()
+                val = interpreter.DEFINITIONS.get(name)
+                for free in NODES.free(val) if val is not None else ():
+                    mentions[name] |= {free} | upstream(free)
+            return mentions[name]
+        
+        levels = []
+        last_write = {}
+        last_read = {}
+        last_other = -1
+        for statement in statements:
+            if isinstance(statement,Assign):
+                names = NODES.free(statement.right)
+                writes = {statement.left.token.value}
+            elif isinstance(statement,Eval):
+                names = NODES.free(statement.expr)
+                writes = set()
+            elif isinstance(statement,Grad):
+                names = frozenset().union(*[NODES.free(func) for func in statement.funcs])
+                names |= {arg.token.value for arg in statement.args}
+                writes = set()
+            else:
+                args = getattr(statement, 'args', None)
+                names = {args.token.value} if isinstance(args,Id) else set()
+                writes = set()
+            reads = set(names)
+            for name in names:
+                reads |= upstream(name)
+                
+            level = 0
+            for name in reads:
+                level = max(level, last_write.get(name, -1) + 1)
+            for name in writes:
+                level = max(level, last_write.get(name, -1) + 1, last_read.get(name, -1) + 1)
+            if not isinstance(statement,Assign):
+                level = last_other = max(level, last_other + 1)
+            levels += [level]
+                
+            for name in reads:
+                last_read[name] = max(last_read.get(name, -1), level)
+            for name in writes:
+                last_write[name] = level
+                mentions[name] = reads
+                
+        waves = [[] for i in range(max(levels, default = -1) + 1)]
+        for statement,level in zip(statements, levels):
+            waves[level] += [statement]
+        return waves
+    
+    def run(self, statements, report = None):
+        """Execute `statements`; returns False if execution was abandoned.
+
+        Errors propagate unless `report` is given, in which case it is
+        called with the failing statement and exception and returns whether
+        to carry on. Save, load, checkpoint, rollback and fork replace
+        bindings the waves are planned from, so each runs on its own and the
+        statements after it are planned once it has.
+        """
+        interpreter = self.interpreter
+        segments = [[]]
+        for statement in statements:
+            if isinstance(statement,BARRIERS):
+                segments += [[statement], []]
+            else:
+                segments[-1] += [statement]
+        # a generator, so a segment is planned after the one before it ran
+        waves = (wave for segment in segments for wave in self.waves(segment))
+        for wave in waves:
+            assigns = [statement for statement in wave if isinstance(statement,Assign)]
+            if len(assigns) > 1:
+                pool = self.executor()
+                futures = []
+                for statement in assigns:
+                    values = {}
+                    for name in NODES.free(statement.right):
+                        val = interpreter.GLOBAL_SCOPE.get(name)
+                        if val is not None:
+                            values[name] = encode(val)
+                    futures += [pool.submit(simplify_remote, encode(statement.right), values)]
+                results = {id(statement): future for statement,future in zip(assigns, futures)}
+            else:
+                results = {}
+                
+            for statement in wave:
+                future = results.get(id(statement))
+                try:
+                    if future is None:
+                        interpreter.visit(statement)
+                    else:
+                        interpreter.assign(statement.left.token.value, decode(future.result()))
+                except Exception as e:
+                    if report is None:
+                        raise
+                    if not report(statement, e):
+                        return False
+                    
+        return True
+                    
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            
+def simplify_remote(tree, values):
+    """Process pool task: simplify an encoded tree against encoded bindings."""
+    global REMOTE
+    if REMOTE is None:
+        REMOTE = Interpreter()
+    REMOTE.GLOBAL_SCOPE = {name: decode(value) for name,value in values.items()}
+    return encode(REMOTE.evaluate(decode(tree)))
+
+# interpreter reused by simplify_remote within a pool worker
+REMOTE = None
+
+def width(node):
+    """Return the number of operands of an AsOp, 1 for any other node."""
+    return len(node.args) if isinstance(node,AsOp) else 1
+
+def operators(node):
+    """Return the number of operator nodes in an interned expression, a
+    shared subtree counted at each occurrence, or the width of a tree that
+    is not interned yet. Either is known without walking the tree."""
+    if node._size is not None:
+        return node._size
+    return width(node)
+
+# passes reported by the stats statement. Sizes are characters in and
+# statements out for the parser, operands for the simplifier passes and
+# operator nodes for whole expressions; all of them cost O(1) per call, so
+# turning stats on does not change how the passes scale.
+PROFILE.instrument(Lexer, 'get_next_token')
+PROFILE.instrument(Parser, 'parse', lambda args: len(args[0].lexer.text),
+                   lambda args, tree: len(tree.children))
+PROFILE.instrument(FunctionalDeriver, 'derive', lambda args: operators(args[0].tree),
+                   lambda args, tree: operators(tree))
+PROFILE.instrument(PartialDeriver, 'derive', lambda args: operators(args[0].right),
+                   lambda args, tree: operators(tree))
+PROFILE.instrument(ReverseDeriver, 'derive', lambda args: operators(args[0].tree),
+                   lambda args, partials: sum(operators(partial) for partial in partials.values()))
+PROFILE.instrument(Interpreter, 'evaluate', lambda args: operators(args[1]),
+                   lambda args, tree: operators(tree))
+for name in ('visit_AsOp', 'simplify', 'chain', 'string', 'combinelike', 'trim'):
+    PROFILE.instrument(Interpreter, name, lambda args: width(args[1]),
+                       lambda args, node: width(node))
     
 def main():
-    interpreter = Interpreter()
-    interpreter.interpret()
+    argparser = argparse.ArgumentParser(description = 'Command line calculus environment.')
+    argparser.add_argument('file', nargs = '?',
+                           help = "script to run, '-' for stdin; starts a prompt if omitted")
+    argparser.add_argument('-k', '--keep-going', action = 'store_true',
+                           help = 'report failing lines and keep executing')
+    argparser.add_argument('-j', '--workers', type = int, default = None,
+                           help = 'simplify independent assignments on this many processes')
+    args = argparser.parse_args()
+    
+    if args.file is None:
+        interpreter = Interpreter()
+        interpreter.interpret()
+        return
+    
+    out = open(sys.stdout.fileno(), 'w', buffering = CHUNK_SIZE, closefd = False)
+    interpreter = Interpreter(out = out, workers = args.workers)
+    if args.file == '-':
+        errors = interpreter.run(sys.stdin, '<stdin>', args.keep_going)
+    else:
+        with open(args.file) as stream:
+            errors = interpreter.run(stream, args.file, args.keep_going)
+    if interpreter.scheduler is not None:
+        interpreter.scheduler.shutdown()
+    out.flush()
+    sys.exit(1 if errors else 0)
     
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,23 @@
+import io
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spi
+
+
+@pytest.fixture
+def run():
+    """Run a script, on a fresh interpreter unless one is given, and return
+    what it printed."""
+    def run(text, interpreter = None):
+        out = io.StringIO()
+        interpreter = interpreter or spi.Interpreter(isolated = True)
+        interpreter.out = out
+        interpreter.run(io.StringIO(text), '<test>')
+        return out.getvalue()
+    return run
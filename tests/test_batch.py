@@ -0,0 +1,27 @@
+import io
+
+from spi import Interpreter
+
+
+def test_failing_statement_skips_only_itself(run):
+    text = 'a=x; show(q); show(a)\n'
+    parallel = Interpreter(workers = 2, isolated = True)
+    try:
+        for interpreter in (Interpreter(isolated = True), parallel):
+            out = io.StringIO()
+            interpreter.out = out
+            assert interpreter.run(io.StringIO(text), '<test>', keep_going = True) == 1
+            assert out.getvalue() == 'x\n'
+    finally:
+        parallel.scheduler.shutdown()
+
+def test_stops_at_first_failure_without_keep_going():
+    out = io.StringIO()
+    interpreter = Interpreter(out = out, isolated = True)
+    assert interpreter.run(io.StringIO('a=x\nshow(q)\nshow(a)\n'), '<test>') == 1
+    assert out.getvalue() == ''
+
+def test_parse_error_reports_line(capsys):
+    interpreter = Interpreter(out = io.StringIO(), isolated = True)
+    assert interpreter.run(io.StringIO('a=x\n\na=*\n'), 'job.spi', keep_going = True) == 1
+    assert capsys.readouterr().err.startswith('job.spi:3: ')
@@ -0,0 +1,26 @@
+import spi
+
+
+def test_dependents_follow_reassignment(run):
+    assert run('y=x*x; z=y*y; x=a+1; show(z)\n') == '{1+(a)}^(4)\n'
+    assert run('y=x*x; x=2; x=q; show(y)\n') == '(q)^(2)\n'
+
+def test_only_downstream_definitions_are_recomputed():
+    interpreter = spi.Interpreter(isolated = True)
+    interpreter.execute('y=x*x; z=y*y; w=q*q; v=w*z')
+    evaluated = []
+    evaluate = interpreter.evaluate
+    def record(node):
+        evaluated.append(node)
+        return evaluate(node)
+    interpreter.evaluate = record
+    interpreter.execute('x=a')
+    
+    definitions = interpreter.DEFINITIONS
+    recomputed = {name for name in definitions.names() if definitions[name] in evaluated}
+    # x itself is evaluated from its new right-hand side
+    assert recomputed == {'x', 'y', 'z', 'v'}
+    # v refers to w and to z, which was bound with x substituted
+    order = interpreter.downstream('x')
+    assert sorted(order) == ['v', 'y', 'z'] and order[-1] == 'v'
+    assert interpreter.downstream('q', seeds = True) == ['q', 'w', 'v']
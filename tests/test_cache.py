@@ -0,0 +1,32 @@
+import spi
+from spi import SimplifyCache
+
+
+def test_least_recently_used_is_evicted():
+    cache = SimplifyCache(2)
+    a,b,c = [spi.NUM(n) for n in (1, 2, 3)]
+    cache.put(a, 'a')
+    cache.put(b, 'b')
+    assert cache.get(a) == 'a'
+    cache.put(c, 'c')
+    assert cache.get(b) is None
+    assert cache.get(a) == 'a' and cache.get(c) == 'c'
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 2)
+
+def test_resize_and_disable():
+    cache = SimplifyCache(3)
+    for n in range(3):
+        cache.put(spi.NUM(n), n)
+    cache.resize(1)
+    assert len(cache) == 1 and cache.get(spi.NUM(2)) == 2
+    cache.resize(0)
+    cache.put(spi.NUM(5), 5)
+    assert len(cache) == 0
+    cache.clear()
+    assert (cache.hits, cache.misses) == (0, 0)
+
+def test_repeated_subexpressions_hit(run):
+    interpreter = spi.Interpreter(isolated = True)
+    assert run('y=x*x+x*x\ncache\n', interpreter) == 'hits=1 misses=2 size=2/4096\n'
+    assert run('z=x*x\ncache(1)\n', interpreter) == 'hits=2 misses=2 size=1/1\n'
+    assert run('cache(0)\nw=x*x\ncache\n', interpreter) == 'hits=2 misses=2 size=0/0\nhits=2 misses=3 size=0/0\n'
@@ -0,0 +1,27 @@
+import io
+
+import spi
+from spi import Compiler, Interpreter
+
+
+def test_compiled_negative_power():
+    interpreter = Interpreter(out = io.StringIO(), isolated = True)
+    interpreter.execute('y=a-x^-1')
+    partial = interpreter.grad([spi.Id(spi.Token(spi.ID,'y'))], ['x'])[0][0]
+    assert Compiler(partial).compile()(2.0) == 0.25
+    square = spi.AsOp(spi.MULTOKEN())
+    square.args = [spi.NODES.reweight(spi.NUM(-2), 2), spi.Id(spi.Token(spi.ID,'x'))]
+    assert Compiler(square).compile()(1) == 4
+
+def test_compile_deep_nesting(run):
+    text = 'y=' + '(' * 300 + 'x' + '+1)*x' * 300 + '; eval(y; x=1)\n'
+    assert run(text) == '301\n'
+
+def test_lambdify_shares_subexpressions():
+    interpreter = Interpreter(isolated = True)
+    interpreter.execute('y=(x+&x)^2*log(x+&x)')
+    function = interpreter.lambdify('y')
+    assert function.names == ['&x', 'x']
+    assert function.source.count('x + d1_x') + function.source.count('d1_x + x') == 1
+    assert abs(function(1.0, 2.0) - 9 * 1.0986122886681098) < 1e-12
+    assert interpreter.lambdify('y') is function
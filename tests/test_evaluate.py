@@ -0,0 +1,29 @@
+import pytest
+
+from interpreter import Interpreter, Lexer
+
+np = pytest.importorskip('numpy')
+
+
+def calc(text):
+    return Interpreter(Lexer(text)).expr()
+
+
+def test_poly_matches_pointwise_values():
+    p = calc('x^3*y - 2*x*y^2 + 5').num
+    xs = np.linspace(-2, 2, 7)
+    ys = np.linspace(0, 3, 7)
+    expected = [p.subs({'x': float(x), 'y': float(y)}) for x,y in zip(xs, ys)]
+    assert np.allclose(p.evaluate({'x': xs, 'y': ys}), expected)
+
+def test_arrays_broadcast():
+    p = calc('x*y + x').num
+    grid = p.evaluate({'x': np.arange(3.0)[:,None], 'y': np.arange(4.0)[None,:]})
+    assert grid.shape == (3, 4)
+    assert grid[2,3] == 2 * 3 + 2
+
+def test_frac_and_missing_variable():
+    f = calc('(x + 1)/(x - 1)')
+    assert np.allclose(f.evaluate({'x': np.array([2.0, 3.0])}), [3.0, 2.0])
+    with pytest.raises(Exception):
+        f.num.evaluate({'y': np.zeros(2)})
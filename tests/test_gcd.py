@@ -0,0 +1,34 @@
+from fractions import Fraction
+
+from interpreter import Interpreter, Lexer, Poly, monomial
+
+
+def calc(text):
+    return Interpreter(Lexer(text)).expr()
+
+def poly(text):
+    return calc(text).num
+
+
+def test_gcd():
+    assert poly('(x+y)*(x-y)').gcd(poly('(x+y)^2')) == poly('x+y')
+    assert poly('2*x*y^2').gcd(poly('4*x^2*y')) == poly('2*x*y')
+    assert poly('x+1').gcd(poly('x+2')) == poly('1')
+
+def test_gcd_multivariate_content():
+    a = poly('(x*y + 1)*(x + y)^2*(z + 1)')
+    b = poly('(x*y + 1)*(x - y)*(z + 1)^2')
+    assert a.gcd(b) == poly('(x*y + 1)*(z + 1)')
+
+def test_frac_is_reduced():
+    f = calc('(x*x - y*y)/(x - y)')
+    assert f.num == poly('x+y')
+    assert f.den == poly('1')
+
+def test_small_fraction_prints_exactly():
+    p = Poly({monomial(('x',), (1,)): Fraction(1,2000)})
+    assert str(p) == '1/2000x'
+
+def test_frac_keeps_exact_coefficients():
+    f = calc('(x/3 + 1/2)/(2*x + 3)')
+    assert f.num == poly('1') and f.den == poly('6')
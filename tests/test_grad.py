@@ -0,0 +1,31 @@
+import io
+
+import spi
+from spi import Compiler, Interpreter
+
+
+def test_grad_folds_coefficients(run):
+    assert run('y=x^-1; grad(y; x)\n') == '-1*(x)^(-2)\n'
+    assert run('y=x-2*x*x; grad(y; x)\n') == '1+{-4*(x)}\n'
+
+def test_grad_of_shared_product_does_not_divide(run):
+    interpreter = Interpreter(out = io.StringIO(), isolated = True)
+    output = run('z=$_y(x*x*a*b*c*d*e*f*g*h*y*y)\ngrad(z; x)\n', interpreter)
+    assert '(-1)' not in output
+    partial = interpreter.grad([spi.Id(spi.Token(spi.ID,'z'))], ['x'])[0][0]
+    function = Compiler(partial).compile()
+    values = {name: 0 if name == 'x' else 2 for name in function.names}
+    assert function(*[values[name] for name in function.names]) == 0
+    values['x'] = 1
+    assert function(*[values[name] for name in function.names]) == 4 * 2 ** 9
+
+def test_scheduler_orders_grad_after_inputs(run):
+    text = 'y=a*b*b; a=2; grad(y; b)\n'
+    interpreter = Interpreter(workers = 2, isolated = True)
+    try:
+        assert run(text, interpreter) == run(text) == '4*(b)\n'
+    finally:
+        interpreter.scheduler.shutdown()
+
+def test_jacobian_rows_and_columns(run):
+    assert run('grad(x*x*y, log(y); x, y)\n') == '2*(x)*(y)\n(x)^(2)\n0\n(y)^(-1)\n'
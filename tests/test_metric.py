@@ -0,0 +1,37 @@
+from interpreter import Interpreter, Lexer, components, read_metric
+
+
+def poly(text):
+    return Interpreter(Lexer(text)).expr().num
+
+def table(metric, name):
+    return {label: (value.num, value.den) for label,value in components(metric, name)}
+
+
+def test_hyperbolic_plane():
+    metric = read_metric('x, y | 1/y^2, 0; 0, 1/y^2')
+    assert (metric.det().num, metric.det().den) == (poly('1'), poly('y^4'))
+    assert table(metric, 'inverse') == {'g^xx': (poly('y^2'), poly('1')),
+                                        'g^yy': (poly('y^2'), poly('1'))}
+    assert table(metric, 'christoffel') == {'G^x_xy': (poly('0-1'), poly('y')),
+                                            'G^y_xx': (poly('1'), poly('y')),
+                                            'G^y_yy': (poly('0-1'), poly('y'))}
+    assert table(metric, 'riemann') == {'R^x_yxy': (poly('0-1'), poly('y^2')),
+                                        'R^y_xxy': (poly('1'), poly('y^2'))}
+    assert table(metric, 'ricci') == {'R_xx': (poly('0-1'), poly('y^2')),
+                                      'R_yy': (poly('0-1'), poly('y^2'))}
+
+def test_flat_metric_has_no_curvature():
+    metric = read_metric('x, y | 1, 0; 0, 1')
+    assert components(metric, 'christoffel') == []
+    assert components(metric, 'riemann') == []
+
+def test_workers_give_the_same_components():
+    text = 'x, y | 1 + x^2, x*y; x*y, 1 + y^2'
+    serial = read_metric(text)
+    parallel = read_metric(text, workers = 2)
+    try:
+        for name in ('christoffel', 'riemann', 'ricci'):
+            assert table(parallel, name) == table(serial, name)
+    finally:
+        parallel.close()
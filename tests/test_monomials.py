@@ -0,0 +1,29 @@
+import pytest
+
+from interpreter import EXP_BITS, Interpreter, Lexer, isvalid, monomial, unpack
+
+
+def poly(text):
+    return Interpreter(Lexer(text)).expr().num
+
+
+def test_monomial_roundtrip():
+    key = monomial(('y','x'), (3,2))
+    assert unpack(key) == (('x','y'), (2,3))
+    assert unpack(0) == ((), ())
+
+def test_monomial_product_is_addition():
+    assert monomial(('x',), (2,)) + monomial(('x','y'), (1,1)) == monomial(('x','y'), (3,1))
+
+def test_monomial_rejects_negative_exponent():
+    with pytest.raises(Exception):
+        monomial(('x',), (-1,))
+
+def test_power_overflow_is_detected():
+    with pytest.raises(Exception):
+        poly('x') ** (1 << (EXP_BITS - 1))
+
+def test_product_keys_add():
+    product = poly('x^2*y') * poly('x*y^3')
+    assert [unpack(key) for key in product.terms] == [(('x','y'), (3,4))]
+    assert all(isvalid(key) for key in product.terms)
@@ -0,0 +1,28 @@
+import spi
+
+
+def parse(text):
+    return spi.Parser(spi.Lexer('y=' + text)).parse().children[0].right
+
+
+def test_interned_subtrees_are_shared():
+    first = spi.NODES.intern(parse('(x+1)*log(x+1)'))
+    second = spi.NODES.intern(parse('log(1+x)*(1+x)'))
+    assert first is second
+    log, = [arg for arg in first.args if isinstance(arg,spi.UnOp)]
+    total, = [arg for arg in first.args if isinstance(arg,spi.AsOp)]
+    assert log.arg is total
+    assert spi.NUM(3) is spi.NODES.intern(spi.Num(spi.Token(spi.INT,3)))
+
+def test_printing_does_not_depend_on_history(run):
+    assert run('b=y+x; show(b)\n') == run('a=x+y; b=y+x; show(b)\n') == '(x)+(y)\n'
+    assert run('b=2*y*x; show(b)\n') == run('a=x*y*2; b=2*y*x; show(b)\n')
+    first = spi.NODES.intern(parse('log(b+a)*c'))
+    second = spi.NODES.intern(parse('c*log(a+b)'))
+    assert first is second
+    log, = [arg for arg in first.args if isinstance(arg,spi.UnOp)]
+    assert [arg.token.value for arg in log.arg.args] == ['a', 'b']
+
+def test_like_terms_combine(run):
+    assert run('y=x*x*x/x; show(y)\n') == '(x)^(2)\n'
+    assert run('y=x*y+y*x+x; show(y)\n') == '(x)+{(x)*(y)}*(2)\n'
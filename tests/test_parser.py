@@ -0,0 +1,45 @@
+import pytest
+
+import spi
+
+
+def parse(text):
+    return spi.Parser(spi.Lexer(text)).parse()
+
+
+def test_tokens_carry_their_offsets():
+    tokens = list(spi.tokenize('y = x*12+ 2.5;show(y)'))
+    assert [(token.type, token.value, offset) for token,offset in tokens[:7]] == \
+        [(spi.ID, 'y', 0), (spi.ASSIGN, '=', 2), (spi.ID, 'x', 4), (spi.MUL, '*', 5),
+         (spi.INT, 12, 6), (spi.ADD, '+', 8), (spi.REAL, 2.5, 10)]
+    assert tokens[8][0].type == spi.show and tokens[8][1] == 14
+
+def test_equal_spellings_share_a_token():
+    tokens = [token for token,offset in spi.tokenize('x+x*x')]
+    assert tokens[0] is tokens[2] is tokens[4]
+
+def test_invalid_character():
+    with pytest.raises(Exception, match = 'Invalid character # at offset 3'):
+        list(spi.tokenize('y=x#'))
+
+def test_lexer_position_and_syntax_errors():
+    lexer = spi.Lexer('y=x+1')
+    for i in range(4):
+        lexer.get_next_token()
+    assert lexer.pos == 3
+    assert lexer.get_next_token().value == 1 and lexer.get_next_token().type == spi.EOF
+    with pytest.raises(Exception, match = 'offset 4'):
+        parse('y=x+)')
+
+def test_sums_and_products_parse_flat():
+    total = parse('y=x+y-z+w').children[0].right
+    assert isinstance(total,spi.AsOp) and total.token.type == spi.ADD
+    assert [arg.weight for arg in total.args] == [1, 1, -1, 1]
+    product = parse('y=x*y/z*w^2').children[0].right
+    assert product.token.type == spi.MUL and len(product.args) == 4
+    assert [arg.weight for arg in product.args][:3] == [1, 1, -1]
+
+def test_deep_nesting_parses_without_recursion(run):
+    tree = parse('y=' + '(' * 5000 + 'x' + ')' * 5000).children[0].right
+    assert isinstance(tree,spi.Id)
+    assert run('y=' + '(' * 3000 + 'x' + '+1)*x' * 3000 + '; z=y\n') == ''
@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+import interpreter
+from spi import Interpreter
+
+
+def poly(text):
+    return interpreter.Interpreter(interpreter.Lexer(text)).expr().num
+
+
+def test_multinomial_power():
+    assert poly('(x+y+1)^3') == poly('(x+y+1)*(x+y+1)*(x+y+1)')
+
+def test_zero_divisor_raises(run):
+    for text in ('y=x/(x-x)', 'y=x/(y-y)', 'y=0^-1'):
+        interpreter = Interpreter(out = io.StringIO(), isolated = True)
+        with pytest.raises(ZeroDivisionError):
+            interpreter.execute(text)
+    assert run('y=x*(z-z)*0^2; show(y)\n') == '0\n'
+    # a zero that is subtracted is not a divisor
+    for text in ('y=a-0', 'y=a-(x-x)*b', 'y=a-(x-x)', 'y=x-x; z=a-y; y=z'):
+        assert run(text + '; show(y)\n') == '(a)\n'
+
+def test_power_chains_to_the_right(run):
+    assert run('y=2^3^2*x; show(y)\n') == run('y=2^9*x; show(y)\n')
+    assert poly('2^3^2') == poly('512')
+    assert run('y=x^2*x^-3; show(y)\n') == '(x)^(-1)\n'
+    assert run('y=(x*y)^2/y; show(y)\n') == '(x)^(2)*(y)\n'
@@ -0,0 +1,38 @@
+import io
+import json
+
+import spi
+from profiling import PROFILE
+
+
+def test_stats_counts_passes():
+    out = io.StringIO()
+    interpreter = spi.Interpreter(out = out, isolated = True)
+    try:
+        interpreter.execute('stats(reset); stats(on)')
+        interpreter.execute('y=&(x*x*y)')
+        interpreter.execute('stats(json)')
+    finally:
+        interpreter.execute('stats(off)')
+    passes = json.loads(out.getvalue())
+    # the statement printing the stats was parsed while they were on
+    parse = passes['Parser.parse']
+    assert (parse['calls'], parse['in'], parse['out']) == (2, len('y=&(x*x*y)stats(json)'), 2)
+    assert passes['FunctionalDeriver.derive']['calls'] == 1
+    assert passes['Interpreter.evaluate']['calls'] == 2
+    
+    # off, the original methods are back and nothing more is counted
+    before = PROFILE.dump()
+    interpreter.execute('z=x*x')
+    assert PROFILE.dump() == before
+    assert spi.Interpreter.evaluate is spi.Interpreter.__dict__['evaluate']
+    PROFILE.reset()
+    assert '(profiling is off)' in PROFILE.command()
+
+def test_sizes_are_memoized():
+    tree = spi.Parser(spi.Lexer('y=(x+1)*(x+1)*log(x+1)')).parse().children[0].right
+    assert spi.operators(tree) == spi.width(tree) == 3
+    node = spi.NODES.intern(tree)
+    # the sum counts at each of its three occurrences
+    assert spi.operators(node) == 5
+    assert spi.operators(spi.NODES.intern(spi.Id(spi.Token(spi.ID,'x')))) == 0
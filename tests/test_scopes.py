@@ -0,0 +1,83 @@
+import io
+
+import pytest
+
+from spi import EMPTY_MAP, Interpreter, PMap, Scope
+
+
+def value(interpreter, name):
+    return interpreter.GLOBAL_SCOPE.get(name)
+
+
+class Colliding(object):
+    """A key whose hash every other instance shares."""
+    def __init__(self, name):
+        self.name = name
+        
+    def __hash__(self):
+        return 7
+    
+    def __eq__(self, opp):
+        return isinstance(opp,Colliding) and self.name == opp.name
+
+def test_pmap_set_get_delete():
+    m = EMPTY_MAP
+    for i in range(1000):
+        m = m.set(f'v{i}', i)
+    assert len(m) == 1000
+    assert all(m.get(f'v{i}') == i for i in range(1000))
+    for i in range(0, 1000, 2):
+        m = m.delete(f'v{i}')
+    assert len(m) == 500
+    assert m.get('v2') is None and m.get('v3') == 3
+    assert sorted(m) == sorted(f'v{i}' for i in range(1, 1000, 2))
+
+def test_pmap_is_persistent():
+    a = PMap().set('x', 1)
+    b = a.set('x', 2).set('y', 3)
+    assert a.get('x') == 1 and 'y' not in a
+    assert b.get('x') == 2 and b.get('y') == 3
+    assert a.delete('missing') is a
+
+def test_pmap_hash_collisions():
+    m = EMPTY_MAP
+    keys = [Colliding(name) for name in 'abcd']
+    for i,key in enumerate(keys):
+        m = m.set(key, i)
+    assert [m.get(key) for key in keys] == [0, 1, 2, 3]
+    m = m.delete(keys[1])
+    assert len(m) == 3 and m.get(keys[1]) is None and m.get(keys[2]) == 2
+
+def test_scope_checkpoint_rollback_fork():
+    scope = Scope()
+    scope['x'] = 1
+    state = scope.checkpoint()
+    scope['x'] = 2
+    del scope['x']
+    assert 'x' not in scope
+    scope.rollback(state)
+    assert scope['x'] == 1
+    
+    fork = scope.fork()
+    fork['x'] = 3
+    assert scope['x'] == 1 and fork['x'] == 3
+    with pytest.raises(KeyError):
+        del scope['y']
+
+def test_interpreter_checkpoint_and_fork(run):
+    interpreter = Interpreter(out = io.StringIO(), isolated = True)
+    output = run('y=x*x\ncheckpoint\ny=x\nshow(y)\nrollback\nshow(y)\n', interpreter)
+    assert output.split() == ['x', '(x)^(2)']
+    
+    other = interpreter.fork()
+    other.execute('y=z')
+    assert value(interpreter, 'y') is not value(other, 'y')
+    assert run('show(y)\n', interpreter) == '(x)^(2)\n'
+
+def test_named_checkpoints_and_branches(run):
+    interpreter = Interpreter(isolated = True)
+    output = run('k=1; checkpoint(one); k=2; checkpoint(two); k=3\n'
+                 'rollback(one); show(k); rollback(two); show(k)\n'
+                 'fork(b); k=4; fork(main); show(k); fork(b); show(k)\n', interpreter)
+    assert output.split() == ['1', '2', '2', '4']
+    assert interpreter.branch == 'b'
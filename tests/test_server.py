@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+from server import Server, serve
+
+
+async def connect(path):
+    reader,writer = await asyncio.open_unix_connection(path)
+    async def call(method, params = None, id = 1):
+        request = {'jsonrpc': '2.0', 'id': id, 'method': method, 'params': params or {}}
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+    return call,writer
+
+def serving(tmp_path, test, workers = 2):
+    """Run the coroutine function `test` against a server on a Unix socket."""
+    path = str(tmp_path / 'spi.sock')
+    server = Server(workers)
+    async def main():
+        task = asyncio.ensure_future(serve(server, path = path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        try:
+            await test(path, server)
+        finally:
+            task.cancel()
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+
+
+def test_sessions_are_isolated(tmp_path):
+    async def test(path, server):
+        first,a = await connect(path)
+        second,b = await connect(path)
+        response = await first('execute', {'text': 'y=x*x; show(y)'})
+        assert response['result']['output'] == '(x)^(2)\n'
+        response = await second('execute', {'text': 'show(y)'})
+        assert response['error']['message'] == 'y does not exist in global scope'
+        response = await first('execute', {'text': 'z=y*y; show(z)'})
+        assert response['result']['output'] == '(x)^(4)\n'
+        metrics = await second('metrics')
+        assert metrics['result']['sessions'] == 2
+        assert metrics['result']['methods']['execute']['count'] == 3
+        assert metrics['result']['methods']['execute']['errors'] == 1
+        a.close()
+        b.close()
+    serving(tmp_path, test)
+
+def test_errors(tmp_path):
+    async def test(path, server):
+        call,writer = await connect(path)
+        assert (await call('nothing'))['error']['code'] == -32601
+        assert (await call('execute', {'text': 3}))['error']['code'] == -32602
+        response = await call('execute', {'text': 'y=x; show(y); show(q)'})
+        assert response['error']['data'] == {'output': 'x\n'}
+        writer.close()
+    serving(tmp_path, test)
+
+def test_busy_session_does_not_block_others(tmp_path):
+    fifo = str(tmp_path / 'fifo')
+    os.mkfifo(fifo)
+    def release():
+        # a writer lets the load open the pipe, which it then cannot map
+        open(fifo, 'wb').close()
+    # should the loop be blocked after all, release it so the test fails
+    timer = threading.Timer(10, release)
+    timer.daemon = True
+    async def test(path, server):
+        first,a = await connect(path)
+        second,b = await connect(path)
+        timer.start()
+        # the load waits in its worker until the pipe has a writer
+        busy = asyncio.ensure_future(first('execute', {'text': f'load("{fifo}")'}))
+        response = await asyncio.wait_for(second('execute', {'text': 'y=x*x; show(y)'}), 30)
+        assert response['result']['output'] == '(x)^(2)\n'
+        assert not busy.done()
+        timer.cancel()
+        release()
+        assert 'error' in await busy
+        a.close()
+        b.close()
+    serving(tmp_path, test)
@@ -0,0 +1,64 @@
+import io
+
+import pytest
+
+import spi
+from spi import Interpreter, LazyScope
+
+
+def value(interpreter, name):
+    return interpreter.GLOBAL_SCOPE.get(name)
+
+
+def test_lazy_scope_loads_once():
+    calls = []
+    scope = LazyScope()
+    scope.defer('x', lambda: calls.append(1) or 5)
+    assert 'x' in scope and scope.names() == {'x'}
+    assert scope.get('x') == 5 and scope.get('x') == 5
+    assert calls == [1]
+
+def test_snapshot_roundtrip(tmp_path, run):
+    path = str(tmp_path / 'work.spiw')
+    first = Interpreter(out = io.StringIO(), isolated = True)
+    run(f'a=x*x+3; b=a*y; c=log(a)*a\nsave("{path}")\n', first)
+    
+    second = Interpreter(out = io.StringIO(), isolated = True)
+    run(f'load("{path}")\n', second)
+    for name in 'abc':
+        assert value(second, name) is value(first, name)
+
+def test_snapshot_rebinds_outside_variables(tmp_path, run):
+    path = str(tmp_path / 'work.spiw')
+    first = Interpreter(out = io.StringIO(), isolated = True)
+    run(f'b=a*y\nsave("{path}")\n', first)
+    
+    second = Interpreter(out = io.StringIO(), isolated = True)
+    assert run(f'a=x\nload("{path}")\nshow(b)\n', second) == '(x)*(y)\n'
+
+def test_save_keeps_loaded_snapshot_intact(tmp_path, run):
+    path = str(tmp_path / 'work.spiw')
+    interpreter = Interpreter(out = io.StringIO(), isolated = True)
+    text = (f'a=x*x; b=a*y+z\nsave("{path}")\nfork(b)\nload("{path}")\n'
+            f'fork(main)\nq=1\nsave("{path}")\nfork(b)\nshow(b)\n')
+    assert run(text, interpreter) == '(z)+{(x)^(2)*(y)}\n'
+    assert [entry.name for entry in tmp_path.iterdir()] == ['work.spiw']
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not a snapshot' * 4)
+    with pytest.raises(Exception):
+        spi.Snapshot(str(path))
+
+def test_big_integers_and_shared_subtrees(tmp_path, run):
+    path = str(tmp_path / 'work.spiw')
+    big = 1 << 80
+    run(f'a=(x+{big})*log(x+{big})\nsave("{path}")\n')
+    assert spi.Snapshot(path).bindings.keys() == {'a'}
+    interpreter = Interpreter(isolated = True)
+    run(f'load("{path}")\n', interpreter)
+    a = value(interpreter, 'a')
+    log, = [arg for arg in a.args if isinstance(arg,spi.UnOp)]
+    total, = [arg for arg in a.args if isinstance(arg,spi.AsOp)]
+    assert log.arg is total
+    assert big in [arg.token.value for arg in total.args]
@@ -0,0 +1,36 @@
+from fractions import Fraction
+
+import pytest
+
+from interpreter import Interpreter, Lexer
+
+
+def calc(text):
+    return Interpreter(Lexer(text)).expr()
+
+
+def test_poly_subs_is_exact():
+    p = calc('x^3*y - 2*x*y^2 + 5').num
+    assert p.subs({'x': 2, 'y': Fraction(1, 3)}) == Fraction(65, 9)
+    assert p.subs({'x': 2, 'y': 1}) == 9
+    with pytest.raises(Exception):
+        p.subs({'x': 2})
+
+def test_horner_form_is_compiled_once_and_refreshed():
+    p = calc('x^2 + x + 1').num
+    form = p.horner()
+    assert p.horner() is form and form.names == ('x',)
+    assert p.subs({'x': 3}) == 13
+    p += calc('x^3').num
+    assert p.horner() is not form
+    assert p.subs({'x': 3}) == 40
+
+def test_frac_subs():
+    assert calc('(x+1)/(x-1)').subs({'x': 3}) == 2
+    assert calc('(x+1)/(x-1)').subs({'x': Fraction(1, 2)}) == -3
+
+def test_spi_eval(run, capsys):
+    assert run('y=x*x*t; eval(&y; x=3, t=0.5, &x=1, &t=0)\n') == '3.0\n'
+    assert run('y=x^-1+log(x); eval(y; x=1)\n') == '1.0\n'
+    assert run('eval(x*y; x=2)\n') == ''
+    assert capsys.readouterr().err == '<test>:1: no value for y\n'
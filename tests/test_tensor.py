@@ -0,0 +1,57 @@
+import pytest
+
+from interpreter import Frac, Interpreter, Lexer, Tensor
+
+
+def calc(text):
+    return Interpreter(Lexer(text)).expr()
+
+def poly(text):
+    return calc(text).num
+
+
+def test_det_and_inverse():
+    m = Tensor.matrix([[calc('x'), calc('1')], [calc('1'), calc('y')]], symmetric = True)
+    det = m.det()
+    assert det.num == poly('x*y - 1') and det.den == poly('1')
+    inv = m.inverse()
+    assert inv[0,0].num == poly('y') and inv[0,0].den == poly('x*y - 1')
+    assert inv[1,0].num == poly('0 - 1')
+
+def test_det_with_fractions():
+    m = Tensor.matrix([[calc('1/x'), calc('y')], [calc('1'), calc('x')]])
+    det = m.det()
+    assert det.num == poly('1 - y') and det.den == poly('1')
+
+def test_inverse_times_matrix_is_identity():
+    rows = [[calc('x'), calc('y'), calc('1')],
+            [calc('0'), calc('x+1'), calc('y')],
+            [calc('2'), calc('0'), calc('x*y')]]
+    m = Tensor.matrix(rows)
+    inv = m.inverse()
+    for i in range(3):
+        for j in range(3):
+            total = Frac()
+            for k in range(3):
+                total += rows[i][k] * inv[k,j]
+            assert total.num == poly('1' if i == j else '0')
+            assert total.den == poly('1')
+
+def test_singular_matrix():
+    m = Tensor.matrix([[calc('x'), calc('y')], [calc('2*x'), calc('2*y')]])
+    assert m.det().iszero()
+    with pytest.raises(Exception):
+        m.inverse()
+
+def test_symmetries():
+    t = Tensor(2, 3, [(1,2,-1)])
+    t[0,1,0] = calc('x')
+    assert t[0,0,1].num == poly('0-x')
+    assert (0,0,1) in t and len(t) == 1
+    assert t[1,1,1].iszero()
+    with pytest.raises(Exception):
+        t[1,0,0] = calc('1')
+    t[0,0,1] = calc('0')
+    assert len(t) == 0
+    with pytest.raises(Exception):
+        Tensor.matrix([[calc('1'), calc('x')], [calc('y'), calc('1')]], symmetric = True)
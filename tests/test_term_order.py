@@ -0,0 +1,28 @@
+from interpreter import Interpreter, Lexer, descending, monomial, printed, unpack
+
+
+def calc(text):
+    return Interpreter(Lexer(text)).expr()
+
+def poly(text):
+    return calc(text).num
+
+
+def test_terms_in_grevlex_order():
+    p = poly('z^2 + x*z + y^2 + x^2 + x*y*z')
+    assert list(p.terms) == descending(p.terms)
+    assert [unpack(key) for key in printed(p.terms)] == [(('x','y','z'), (1,1,1)), (('x',), (2,)),
+                                                          (('y',), (2,)), (('x','z'), (1,1)),
+                                                          (('z',), (2,))]
+
+def test_printed_order_ignores_interning_order():
+    keys = [monomial(('q',), (1,)), monomial(('p',), (1,))]
+    assert printed(keys) == printed(list(reversed(keys)))
+    assert unpack(printed(keys)[0]) == (('p',), (1,))
+
+def test_merge_keeps_term_order():
+    p = poly('x^3 + y')
+    p += poly('x^2*y + x + 1')
+    p -= poly('y')
+    assert list(p.terms) == descending(p.terms)
+    assert p == poly('x^3 + x^2*y + x + 1')